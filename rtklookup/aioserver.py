@@ -0,0 +1,204 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+""" Asynchronous query server (e.g. as backend for a web frontend).
+
+Protocol (TCP, utf-8): The client sends one query per line. A query is a
+line of search words like in the default mode of the command line user
+interface, or '.p <primitives>' for a primitive search. For every query, the
+server answers with one json line (see serializer.result_to_dict), in the
+order of the queries. Clients can send further queries without waiting for
+the answers (pipelining).
+
+Queries that arrive at about the same time (from any connection) are
+resolved together with a single call to KanjiCollection.search_many.
+Backpressure: Every connection has at most MAX_PENDING unanswered queries,
+after that the server stops reading from it. Likewise, the server stops
+reading while a client doesn't read the answers.
+"""
+
+import json
+import asyncio
+from typing import List
+from rtklookup.log import logger
+from rtklookup.config import config
+from rtklookup.collection import KanjiCollection
+from rtklookup.searchresults import SearchResult, SearchResultGroup, \
+    resolve_results
+from rtklookup.serializer import result_to_dict
+
+
+# unanswered queries per connection
+MAX_PENDING = 256
+# queries that are resolved together
+MAX_BATCH = 1024
+
+
+class Batcher(object):
+    """ Collects the queries of all connections and resolves everything that
+    is waiting in one go. """
+    def __init__(self, kanji_collection: KanjiCollection):
+        self.kanji_collection = kanji_collection
+        self.queue = asyncio.Queue(maxsize=MAX_BATCH)
+        # statistics
+        self.batches = 0
+        self.queries = 0
+
+    async def submit(self, query: str) -> asyncio.Future:
+        """ Adds a query. Waits if too many queries are queued.
+        :param query: One line of input
+        :return: Future that will hold the SearchResult.
+        """
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((query, future))
+        return future
+
+    async def run(self):
+        """ Resolves queries forever. """
+        while True:
+            batch = [await self.queue.get()]
+            while not self.queue.empty() and len(batch) < MAX_BATCH:
+                batch.append(self.queue.get_nowait())
+            try:
+                self.resolve(batch)
+            except Exception as e:
+                logger.error("Failed to resolve queries: {}".format(e))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def resolve(self, batch: List):
+        """ Resolves a batch of queries and sets the futures.
+        :param batch: List of (query, future) tuples
+        :return: None
+        """
+        self.batches += 1
+        self.queries += len(batch)
+        general = []
+        for query, future in batch:
+            if query.startswith(".p "):
+                primitives = query[3:].strip()
+                result = SearchResult(primitives, mode="primitive")
+                group = SearchResultGroup(primitives)
+                group.kanji = self.kanji_collection.primitive_search(
+                    primitives.split(' '))
+                if group.has_kanji:
+                    result.groups = [group]
+                future.set_result(result)
+            else:
+                general.append((SearchResult.from_line(query), future))
+        resolve_results(self.kanji_collection,
+                        [result for result, _ in general])
+        for result, future in general:
+            future.set_result(result)
+
+
+class AsyncLookupServer(object):
+    """ Serves the connections. """
+    def __init__(self, kanji_collection: KanjiCollection):
+        self.batcher = Batcher(kanji_collection)
+        # of the open connections (closed on shutdown)
+        self.writers = set()
+
+    async def handle_connection(self, reader: asyncio.StreamReader,
+                                writer: asyncio.StreamWriter):
+        self.writers.add(writer)
+        pending = asyncio.Queue(maxsize=MAX_PENDING)
+        respond = asyncio.ensure_future(self._respond(pending, writer))
+        try:
+            while not respond.done():
+                line = await reader.readline()
+                if not line:
+                    break
+                query = line.decode("utf-8", errors="replace").strip().lower()
+                if not query:
+                    continue
+                # blocks if the client has too many unanswered queries
+                if not await self._put(pending,
+                                       await self.batcher.submit(query),
+                                       respond):
+                    break
+            # signal the end of the queries
+            if await self._put(pending, None, respond):
+                await respond
+        except ConnectionError:
+            pass
+        finally:
+            respond.cancel()
+            writer.close()
+            self.writers.discard(writer)
+
+    @staticmethod
+    async def _put(pending: asyncio.Queue, item, respond: asyncio.Future) \
+            -> bool:
+        """ Puts $item into $pending unless $respond ends (e.g. because the
+        client disconnected) before there is room.
+        :return: False if $respond ended, True otherwise
+        """
+        if respond.done():
+            return False
+        try:
+            pending.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            pass
+        put = asyncio.ensure_future(pending.put(item))
+        await asyncio.wait([put, respond],
+                           return_when=asyncio.FIRST_COMPLETED)
+        if put.done():
+            return True
+        put.cancel()
+        return False
+
+    @staticmethod
+    async def _respond(pending: asyncio.Queue, writer: asyncio.StreamWriter):
+        """ Writes the answers in the order of the queries. """
+        while True:
+            future = await pending.get()
+            if future is None:
+                return
+            try:
+                response = result_to_dict(await future)
+            except Exception as e:
+                response = {"error": str(e)}
+            writer.write(json.dumps(response, ensure_ascii=False).encode(
+                "utf-8") + b"\n")
+            try:
+                # blocks if the client doesn't read the answers
+                await writer.drain()
+            except ConnectionError:
+                return
+
+
+def serve(kanji_collection: KanjiCollection, host=None, port=None):
+    """ Runs the server (blocks until interrupted).
+    :param kanji_collection: Loaded KanjiCollection
+    :param host: Default: from config
+    :param port: Default: from config
+    :return: None
+    """
+    if host is None:
+        host = config.get("aioserver", "host", fallback="127.0.0.1")
+    if port is None:
+        port = config.getint("aioserver", "port", fallback=8765)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    # create the queues only after setting the loop
+    server = AsyncLookupServer(kanji_collection)
+    batcher = loop.create_task(server.batcher.run())
+    tcp_server = loop.run_until_complete(
+        asyncio.start_server(server.handle_connection, host, port)
+    )
+    logger.info("Listening on {}:{}.".format(host, port))
+    try:
+        loop.run_forever()
+    finally:
+        tcp_server.close()
+        # wait_closed waits for the connections to end
+        for writer in list(server.writers):
+            writer.close()
+        loop.run_until_complete(tcp_server.wait_closed())
+        batcher.cancel()
+        logger.debug("Resolved {} queries in {} batches.".format(
+            server.batcher.queries, server.batcher.batches))
+        loop.close()
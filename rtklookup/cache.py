@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+""" A small least recently used (LRU) cache for search results.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """ Dictionary like cache that holds at most $maxsize items. If it is
+    full, the least recently used item is dropped. Counts hits, misses and
+    evictions. Can be shared between threads.
+    """
+    def __init__(self, maxsize=1024):
+        """
+        :param maxsize: Maximal number of items. 0 disables the cache.
+        """
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """ Returns the cached value or $default. """
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """ Adds an item, dropping the least recently used one if the cache
+        is full. """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """ Drops all items (but keeps the counters). """
+        with self._lock:
+            self._data.clear()
+
+    @property
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxsize": self.maxsize,
+                "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions}
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
@@ -8,11 +8,48 @@ import os
 import os.path
 import sys
 import csv
-from typing import List
+import threading
+from bisect import bisect_left
+from typing import List, Tuple, Dict, Set, Iterable
+from collections import Counter
 from rtklookup.log import logger
 from rtklookup.config import config
-from pkg_resources import resource_stream, resource_filename
-import codecs
+from rtklookup import snapshot
+from rtklookup.ngram import NgramIndex, NGRAM_LENGTH
+from rtklookup.fuzzy import FuzzyIndex, MAX_DISTANCE, default_distance, \
+    scan as fuzzy_scan
+from rtklookup.cache import LRUCache
+from rtklookup.resources import resource_filename
+from rtklookup.stats import stats
+
+
+# Further editions of the kanji database are described by config sections
+# '[rtk_data.<name>]' with the same options as '[rtk_data]', which holds
+# the default edition.
+DEFAULT_EDITION = "default"
+EDITION_SECTION_PREFIX = "rtk_data."
+
+
+def edition_names() -> List[str]:
+    """ Names of all configured editions (default edition first). """
+    return [DEFAULT_EDITION] + [
+        section[len(EDITION_SECTION_PREFIX):] for section in config.sections()
+        if section.startswith(EDITION_SECTION_PREFIX)]
+
+
+# The different kinds of searches KanjiCollection.search can perform
+SEARCH_MODES = ["index", "substring", "token", "anagram", "fuzzy", "keyword",
+                "kanji"]
+# Lazy indices are only built once this many searches could have used them.
+# Until then, the searches scan the keywords, which is faster as long as
+# there are only a few of them (e.g. a single 'rtk fin?' call): Roughly the
+# time to build the index divided by what it saves per search.
+INDEX_THRESHOLDS = {"keyword_ngrams": 64, "letter_counts": 5,
+                    "keyword_fuzzy": 8}
+
+# Only the results of these modes are cached, the others are mere dictionary
+# lookups that are faster than the cache itself.
+CACHED_SEARCH_MODES = {"substring", "anagram", "fuzzy"}
 
 
 # todo: set config as a class variable instead of using it as a global variable
@@ -20,6 +57,9 @@ class Kanji(object):
     """ An object of this Class contains a kanji with the corresponding
     information (index, keyword, story etc).
     """
+    # no per instance __dict__: saves memory as there are thousands of these
+    __slots__ = ("kanji", "index", "keyword", "story")
+
     def __init__(self, kanji: str):
         self.kanji = kanji
         self.index = ""
@@ -43,16 +83,64 @@ class Kanji(object):
 # todo: shouldn't the loading process maybe be done from outside?
 class KanjiCollection(object):
     """An object of this Class bundles sevaral Kanji objects.
+    Other editions of the kanji database are held by further KanjiCollections
+    which are created on demand (see edition()).
     """
-    def __init__(self):
+    def __init__(self, section="rtk_data"):
+        """
+        :param section: Config section describing the kanji database
+        """
+        self.section = section
+        if section.startswith(EDITION_SECTION_PREFIX):
+            self.edition_name = section[len(EDITION_SECTION_PREFIX):]
+        else:
+            self.edition_name = DEFAULT_EDITION
+
         # a plain list of Kanji objects
         self.kanjis = []  # type: List[Kanji]
         self.keyword_to_obj = {}
         self.kanji_to_obj = {}
         self.index_to_obj = {}
+        # position of the Kanji objects in self.kanjis
+        self.kanji_to_pos = {}
+        # single words of the keywords to the Kanji objects whose keyword
+        # contains them (in the order of self.kanjis)
+        self.token_to_objs = {}  # type: Dict[str, List[Kanji]]
+        # substrings of keywords and stories to positions in self.kanjis
+        # (built on first use, see the properties below)
+        self._keyword_ngrams = None  # type: NgramIndex
+        self._story_ngrams = None  # type: NgramIndex
+        # (letter, number of occurrences in keyword) to positions in
+        # self.kanjis (built on first use)
+        self._letter_counts = None  # type: Dict[Tuple[str, int], Set[int]]
+        # keywords with typos (built on first use)
+        self._keyword_fuzzy = None  # type: FuzzyIndex
+        # sorted keywords and single words of keywords for prefix searches
+        # (built on first use)
+        self._prefix_keys = None  # type: List[str]
+        # number of searches that could have used the lazy indices (see
+        # INDEX_THRESHOLDS)
+        self._index_uses = {}  # type: Dict[str, int]
+
+        # (search mode, normalized search phrase) to results
+        self.cache = LRUCache(config.getint("cache", "size", fallback=1024))
 
         # did we load any stories?
         self.stories_available = False
+        # story file that still has to be parsed
+        self._stories_file = None
+        # the collection can be shared between threads (see daemon.py), the
+        # lock protects loading the stories on demand
+        self._stories_lock = threading.Lock()
+        # kanji to story, for all kanji of the story file (also shared with
+        # the other editions)
+        self.stories = {}  # type: Dict[str, str]
+        # collection whose stories are used by this edition (if any)
+        self._stories_parent = None  # type: KanjiCollection
+
+        # other editions: name to KanjiCollection
+        self._editions = {}  # type: Dict[str, KanjiCollection]
+        self._editions_lock = threading.Lock()
 
     # ------------- Load information from files -------------------------------
 
@@ -65,55 +153,146 @@ class KanjiCollection(object):
 
     def _load_file_rtk(self):
         """Load the file that contains the RTK kanji, indizes and keywords.
+        Uses the binary snapshot of the file if there is an up to date one.
         """
 
         # we just raise exceptions and catch them later
 
-        resource = ('rtklookup', 'data/rtk_data.tsv')
-        filename = resource_filename(*resource)
+        filename = resource_filename(config[self.section]["path"])
 
         if not os.path.exists(filename):
             logger.fatal("File %s (meant to contain heisig indizes) "
                          "not found. " % filename)
             raise ValueError
 
-        delim = bytes(config["rtk_data"]["delim"], "utf-8").decode(
+        records = None
+        if snapshot.enabled():
+            with stats.timer("load.snapshot"):
+                records = snapshot.load(self.section, filename, self.section)
+        if records is None:
+            with stats.timer("load.parse"):
+                records = self._read_file_rtk(filename, self.section)
+            if snapshot.enabled():
+                with stats.timer("load.snapshot_save"):
+                    snapshot.save(self.section, filename, self.section,
+                                  records)
+
+        with stats.timer("load.add_kanji"):
+            self._add_kanjis(records)
+
+    @staticmethod
+    def _read_file_rtk(filename: str, section="rtk_data") \
+            -> List[Tuple[str, str, str]]:
+        """Parse the file that contains the RTK kanji, indizes and keywords.
+        :param filename:
+        :param section: Config section describing the file
+        :return: List of (kanji, index, keyword) tuples
+        """
+        delim = bytes(config[section]["delim"], "utf-8").decode(
             "unicode_escape")
-
-        io = resource_stream(*resource)
-        csvfile = codecs.getreader("utf-8")(io)
-        reader = csv.reader(csvfile, delimiter=delim)
-        for row in reader:
-            kanji = row[config.getint("rtk_data", "kanji_column")].strip()
-            index = row[config.getint("rtk_data", "index_column")].strip()
-            keyword = row[config.getint("rtk_data",
-                                        "keyword_column")].strip().lower()
+        kanji_column = config.getint(section, "kanji_column")
+        index_column = config.getint(section, "index_column")
+        keyword_column = config.getint(section, "keyword_column")
+
+        records = []
+        with open(filename, encoding="utf-8", newline="") as csvfile:
+            reader = csv.reader(csvfile, delimiter=delim)
+            for row in reader:
+                records.append((row[kanji_column].strip(),
+                                row[index_column].strip(),
+                                row[keyword_column].strip().lower()))
+        return records
+
+    def _add_kanjis(self, records: Iterable[Tuple[str, str, str]]):
+        """Add kanji to the collection.
+        :param records: (kanji, index, keyword) tuples
+        """
+        # local names: this loop runs for every kanji on every startup
+        intern = sys.intern
+        kanjis = self.kanjis
+        keyword_to_obj = self.keyword_to_obj
+        kanji_to_obj = self.kanji_to_obj
+        index_to_obj = self.index_to_obj
+        kanji_to_pos = self.kanji_to_pos
+        token_to_objs = self.token_to_objs
+
+        for kanji, index, keyword in records:
+            # the strings are also used as dictionary keys, interning them
+            # makes sure that there's only one copy of each
+            kanji = intern(kanji)
+            keyword = intern(keyword)
 
             kanji_obj = Kanji(kanji)
-            kanji_obj.index = index
+            kanji_obj.index = intern(index)
             kanji_obj.keyword = keyword
 
-            self.kanjis.append(kanji_obj)
-            self.keyword_to_obj[keyword] = kanji_obj
-            self.kanji_to_obj[kanji] = kanji_obj
-            self.index_to_obj[index] = kanji_obj
-
+            if kanji not in kanji_to_pos:
+                kanji_to_pos[kanji] = len(kanjis)
+            kanjis.append(kanji_obj)
+            keyword_to_obj[keyword] = kanji_obj
+            kanji_to_obj[kanji] = kanji_obj
+            # The first record wins: e.g. the 6th edition column repeats
+            # frame numbers of the main book for the RTK3 rows after it.
+            if kanji_obj.index not in index_to_obj:
+                index_to_obj[kanji_obj.index] = kanji_obj
+            for token in set(keyword.split(' ')):
+                if token in token_to_objs:
+                    token_to_objs[token].append(kanji_obj)
+                else:
+                    token_to_objs[token] = [kanji_obj]
+
+        self._keyword_ngrams = None
+        self._letter_counts = None
+        self._keyword_fuzzy = None
+        self._prefix_keys = None
+        self.cache.clear()
+
+    def load_file_stories(self, filename=None):
+        """Register the file that contains the user's stories. The file is
+        only parsed once the stories are needed (see materialize_stories).
+        :param filename: Defaults to the file from the config.
+        """
+        if filename is None:
+            filename = resource_filename(config["rtk_stories"]["path"])
 
-    def load_file_stories(self):
-        try:
-            self._load_file_stories()
-        except ValueError:
+        if not os.path.exists(filename):
+            logger.warning("File %s (contains user stories) not found. "
+                           "Primitive mode will be unavailable." %
+                           filename)
             logger.warning("Could not load stories for kanji.")
             self.stories_available = False
         else:
+            self._stories_file = filename
             self.stories_available = True
 
-    def _load_file_stories(self):
-        """Load file that contains the RTK kanji, indizes and keywords.
+    def materialize_stories(self):
+        """Parse the story file registered by load_file_stories, unless
+        this has already been done. Has to be called before accessing
+        Kanji.story.
+        """
+        if self._stories_parent is not None:
+            self._share_stories()
+            return
+        if self._stories_file is None:
+            return
+        with self._stories_lock:
+            if self._stories_file is None:
+                # loaded by another thread in the meantime
+                return
+            try:
+                self._load_file_stories(self._stories_file)
+            except ValueError:
+                logger.warning("Could not load stories for kanji.")
+                self.stories_available = False
+            self._stories_file = None
+
+    def _load_file_stories(self, filename=None):
+        """Load file that contains the user's stories for the kanji.
+        :param filename: Defaults to the file from the config.
         """
 
-        resource = ('rtklookup', config["rtk_stories"]["path"])
-        filename = resource_filename(*resource)
+        if filename is None:
+            filename = resource_filename(config["rtk_stories"]["path"])
 
         if not os.path.exists(filename):
             logger.warning("File %s (contains user stories) not found. "
@@ -123,34 +302,168 @@ class KanjiCollection(object):
 
         delim = bytes(config["rtk_stories"]["delim"], "utf-8").decode(
             "unicode_escape")
-
-        io = resource_stream(*resource)
-        csvfile = codecs.getreader("utf-8")(io)
-        reader = csv.reader(csvfile, delimiter=delim)
-        # todo: use unicode normalisation?
-        for row in reader:
-            kanji = row[config.getint("rtk_stories",
-                                        "kanji_column")].strip()
-            story = row[config.getint("rtk_stories",
-                                        "story_column")].strip().lower()
-
-            pos = self.pos_from_kanji(kanji)
-            if pos:
-                self.kanjis[pos].story = story
+        kanji_column = config.getint("rtk_stories", "kanji_column")
+        story_column = config.getint("rtk_stories", "story_column")
+
+        with stats.timer("load.stories"), \
+                open(filename, encoding="utf-8", newline="") as csvfile:
+            reader = csv.reader(csvfile, delimiter=delim)
+            # todo: use unicode normalisation?
+            for row in reader:
+                kanji = row[kanji_column].strip()
+                story = row[story_column].strip().lower()
+
+                self.stories[kanji] = story
+                pos = self.pos_from_kanji(kanji)
+                if pos is not None:
+                    self.kanjis[pos].story = story
+
+        self._story_ngrams = None
+        self.cache.clear()
+
+    def _share_stories(self):
+        """Use the stories of the parent collection (another edition). The
+        story strings are shared, not copied.
+        """
+        parent = self._stories_parent
+        parent.materialize_stories()
+        with self._stories_lock:
+            if self._stories_parent is None:
+                # done by another thread in the meantime
+                return
+            self.stories = parent.stories
+            for kanji_obj in self.kanjis:
+                kanji_obj.story = parent.stories.get(kanji_obj.kanji, "")
+            self.stories_available = parent.stories_available
+            self._story_ngrams = None
+            self.cache.clear()
+            self._stories_parent = None
+
+    def write_index(self, path: str, fingerprint=b""):
+        """Write the kanji, indices and keywords to a read-only index file
+        that can be opened with mmapindex.MappedIndex.
+        :param path:
+        :param fingerprint: Identifies the source data (see
+            snapshot.fingerprint)
+        :return: None
+        """
+        # mmapindex imports this module
+        from rtklookup.mmapindex import write_index
+        write_index(((kanji_obj.kanji, kanji_obj.index, kanji_obj.keyword)
+                     for kanji_obj in self.kanjis), path, fingerprint)
+
+    # ------------- Editions -------------------------------
+
+    def edition(self, name=None) -> "KanjiCollection":
+        """The collection for another edition of the kanji database (see
+        edition_names). It is loaded on first use and shares the stories
+        (and, by interning, all equal strings) with this collection.
+        :param name: Name of the edition. None or the own edition: self
+        :return: KanjiCollection
+        """
+        if not name or name == self.edition_name:
+            return self
+        if self._stories_parent is not None:
+            # an edition: the default edition knows all of them
+            return self._stories_parent.edition(name)
+        with self._editions_lock:
+            if name not in self._editions:
+                section = EDITION_SECTION_PREFIX + name
+                if not config.has_section(section):
+                    raise ValueError("Unknown edition '{}'. Available: "
+                                     "{}".format(name,
+                                                 ", ".join(edition_names())))
+                collection = KanjiCollection(section)
+                with stats.timer("load.edition"):
+                    collection._load_file_rtk()
+                collection.stories_available = self.stories_available
+                collection._stories_parent = self
+                self._editions[name] = collection
+            return self._editions[name]
 
     # used to update values in self.kanjis
     def pos_from_kanji(self, kanji):
         """Given a kanji, returns the position of the corresponding
         Object of class 'Kanji' in self.kanjis.
         :param kanji
-        :return kanji object or None
+        :return position or None
         """
-        for index, kanji_obj in enumerate(self.kanjis):
-            if kanji_obj.kanji == kanji:
-                return index
-
-        # if not found:
-        return None
+        return self.kanji_to_pos.get(kanji)
+
+    @property
+    def keyword_ngrams(self) -> NgramIndex:
+        """ NgramIndex over the keywords. """
+        if self._keyword_ngrams is None:
+            with stats.timer("index.keyword_ngrams"):
+                ngrams = NgramIndex()
+                for pos, kanji_obj in enumerate(self.kanjis):
+                    ngrams.add(pos, kanji_obj.keyword)
+            self._keyword_ngrams = ngrams
+        return self._keyword_ngrams
+
+    @property
+    def story_ngrams(self) -> NgramIndex:
+        """ NgramIndex over the stories. """
+        self.materialize_stories()
+        if self._story_ngrams is None:
+            with stats.timer("index.story_ngrams"):
+                ngrams = NgramIndex()
+                for pos, kanji_obj in enumerate(self.kanjis):
+                    if kanji_obj.story:
+                        ngrams.add(pos, kanji_obj.story)
+            self._story_ngrams = ngrams
+        return self._story_ngrams
+
+    @property
+    def letter_counts(self) -> Dict[Tuple[str, int], Set[int]]:
+        """ Maps (letter, n) to the positions of all keywords that contain
+        the letter exactly n times. """
+        if self._letter_counts is None:
+            with stats.timer("index.letter_counts"):
+                letter_counts = {}
+                for pos, kanji_obj in enumerate(self.kanjis):
+                    for letter, count in Counter(kanji_obj.keyword).items():
+                        letter_counts.setdefault((letter, count),
+                                                 set()).add(pos)
+            self._letter_counts = letter_counts
+        return self._letter_counts
+
+    @property
+    def keyword_fuzzy(self) -> FuzzyIndex:
+        """ FuzzyIndex over the keywords. """
+        if self._keyword_fuzzy is None:
+            with stats.timer("index.keyword_fuzzy"):
+                self._keyword_fuzzy = FuzzyIndex(
+                    self.keyword_to_obj,
+                    max_distance=self._fuzzy_max_distance())
+        return self._keyword_fuzzy
+
+    @staticmethod
+    def _fuzzy_max_distance() -> int:
+        return config.getint("fuzzy", "max_distance", fallback=MAX_DISTANCE)
+
+    def _use_index(self, name: str) -> bool:
+        """ Should a search use the lazy index $name (e.g. 'letter_counts')
+        instead of a scan? Counts the searches that could use it, see
+        INDEX_THRESHOLDS.
+        :param name: Name of the property
+        :return: True if the index is built or worth building now
+        """
+        if getattr(self, "_" + name) is not None:
+            return True
+        uses = self._index_uses.get(name, 0) + 1
+        self._index_uses[name] = uses
+        return uses > INDEX_THRESHOLDS[name]
+
+    @property
+    def prefix_keys(self) -> List[str]:
+        """ Sorted list of all keywords and all single words of keywords.
+        """
+        if self._prefix_keys is None:
+            with stats.timer("index.prefix_keys"):
+                self._prefix_keys = sorted(
+                    set(self.keyword_to_obj) | set(self.token_to_objs))
+        return self._prefix_keys
 
     # ------------- Search -------------------------------
 
@@ -162,72 +475,272 @@ class KanjiCollection(object):
         """
         if not word:
             return
-
         word = word.replace('_', ' ')
-        found = []
+        mode = self.search_mode(word)
+        if not stats.enabled and mode not in CACHED_SEARCH_MODES:
+            return getattr(self, "_search_" + mode)(word)
+        stats.count("queries." + mode)
+        if mode in CACHED_SEARCH_MODES:
+            key = (mode, word)
+            found = self.cache.get(key)
+            if found is None:
+                stats.count("cache.misses")
+                with stats.timer("search." + mode):
+                    found = tuple(getattr(self, "_search_" + mode)(word))
+                self.cache.put(key, found)
+            else:
+                stats.count("cache.hits")
+            found = list(found)
+        else:
+            with stats.timer("search." + mode):
+                found = getattr(self, "_search_" + mode)(word)
+        if stats.enabled:
+            self._count_results(found)
+        return found
 
-        if word.isdigit() and word in self.index_to_obj:
-            # searching for RTK index
-            found.append(self.index_to_obj[word])
+    def search_many(self, words: Iterable[str]) -> List[List[Kanji]]:
+        """ Like search, but for many search phrases at once. Duplicates are
+        only searched once and uncached substring searches are resolved
+        together.
+        :param words: search phrases
+        :return: List with the result of self.search for every search phrase
+            (in the same order).
+        """
+        words = list(words)
+        found = {}  # type: Dict[str, List[Kanji]]
+        substring_words = []  # type: List[str]
+        for word in words:
+            if not word or word in found:
+                continue
+            if word[-1] == "?":
+                word_ = word.replace('_', ' ')
+                cached = self.cache.get(("substring", word_))
+                if cached is None:
+                    found[word] = None
+                    substring_words.append(word_)
+                else:
+                    # (the same as self.search, without a second lookup)
+                    stats.count("queries.substring")
+                    stats.count("cache.hits")
+                    found[word] = list(cached)
+                    if stats.enabled:
+                        self._count_results(found[word])
+                continue
+            found[word] = self.search(word)
+
+        if substring_words:
+            stats.count("queries.substring", len(substring_words))
+            stats.count("cache.misses", len(substring_words))
+            with stats.timer("search.substring"):
+                results = self._search_substring_many(substring_words)
+            for word, result in zip(substring_words, results):
+                self.cache.put(("substring", word), tuple(result))
+                if stats.enabled:
+                    self._count_results(result)
+            substring_results = dict(zip(substring_words, results))
+            for word in found:
+                if found[word] is None:
+                    found[word] = substring_results[word.replace('_', ' ')]
 
-        elif word[-1] == "?":
-            sword = word[:-1]
-            for kanji_obj in self.kanjis:
-                if sword in kanji_obj.keyword:
-                    found.append(kanji_obj)
+        results = []
+        returned = set()
+        for word in words:
+            if not word:
+                results.append(None)
+            elif word in returned:
+                results.append(list(found[word]))
+            else:
+                returned.add(word)
+                results.append(found[word])
+        return results
 
-        elif word[-1] == "+":
-            sword = word[:-1]
-            for kanji_obj in self.kanjis:
-                if sword in kanji_obj.keyword.split(' '):
-                    found.append(kanji_obj)
+    @staticmethod
+    def _count_results(found: List[Kanji]):
+        stats.count("results.kanji", len(found))
+        if not found:
+            stats.count("results.empty")
 
+    def search_mode(self, word: str) -> str:
+        """ Which kind of search is requested by the search phrase?
+        :param word: search phrase (with '_' already replaced by spaces)
+        :return: One of SEARCH_MODES
+        """
+        if word.isdigit() and word in self.index_to_obj:
+            return "index"
+        elif word[-1] == "?":
+            return "substring"
+        elif word[-1] == "+":
+            return "token"
         elif word[-1] == "%":
-            sword = word[:-1]
+            return "anagram"
+        elif word[-1] == "~":
+            return "fuzzy"
+        elif word in self.keyword_to_obj:
+            return "keyword"
+        else:
+            return "kanji"
+
+    def _search_index(self, word: str) -> List[Kanji]:
+        """ Searching for RTK index. """
+        return [self.index_to_obj[word]]
+
+    def _search_substring(self, word: str) -> List[Kanji]:
+        """ 'word?': Keywords containing 'word'. """
+        sword = word[:-1]
+        # (shorter words are too short for the trigram index)
+        if len(sword) >= NGRAM_LENGTH and self._use_index("keyword_ngrams"):
+            return self._substring_search(self.keyword_ngrams, "keyword",
+                                          [sword])
+        return [kanji_obj for kanji_obj in self.kanjis
+                if sword in kanji_obj.keyword]
+
+    def _search_substring_many(self, words: List[str]) -> List[List[Kanji]]:
+        """ Like _search_substring for several search phrases. The
+        phrases that are too short for the trigram index are resolved
+        together with a single scan over all keywords.
+        """
+        results = []
+        short = []
+        for word in words:
+            if len(word) - 1 < NGRAM_LENGTH:
+                results.append([])
+                short.append((word[:-1], results[-1]))
+            else:
+                results.append(self._search_substring(word))
+        if short:
             for kanji_obj in self.kanjis:
-                is_found = True
-                for letter in sword:
-                    if not kanji_obj.keyword.count(letter) == \
-                            sword.count(letter):
-                        is_found = False
-                if is_found:
-                    found.append(kanji_obj)
+                for sword, found in short:
+                    if sword in kanji_obj.keyword:
+                        found.append(kanji_obj)
+        return results
 
-        elif word in self.keyword_to_obj:
-            found.append(self.keyword_to_obj[word])
+    def _search_token(self, word: str) -> List[Kanji]:
+        """ 'word+': Keywords containing the whole word 'word'. """
+        return self.kanji_from_token(word[:-1])
 
-        else:
-            # Map each kanji to the corresponding keyword
-            for letter in word:
-                if letter in self.kanji_to_obj:
-                    found.append(self.kanji_to_obj[letter])
+    def _search_anagram(self, word: str) -> List[Kanji]:
+        """ 'letters%': See _anagram_search. """
+        return self._anagram_search(word[:-1])
 
-        return found
+    def _search_fuzzy(self, word: str) -> List[Kanji]:
+        """ 'word~': Keywords with a small edit distance to 'word' (closest
+        first). """
+        query = word[:-1]
+        if self._use_index("keyword_fuzzy"):
+            found = self.keyword_fuzzy.search(query)
+        else:
+            found = fuzzy_scan(self.keyword_to_obj, query, default_distance(
+                query, self._fuzzy_max_distance()))
+        return [self.keyword_to_obj[keyword] for _, keyword in found]
+
+    def _search_keyword(self, word: str) -> List[Kanji]:
+        """ Exact keyword. """
+        return [self.keyword_to_obj[word]]
+
+    def _search_kanji(self, word: str) -> List[Kanji]:
+        """ Map each kanji to the corresponding keyword. """
+        return [self.kanji_to_obj[letter] for letter in word
+                if letter in self.kanji_to_obj]
+
+    def prefix_search(self, prefix: str, limit=None) -> List[str]:
+        """ Keywords and single words of keywords that start with $prefix
+        (e.g. to complete user input).
+        :param prefix: '_' can be used instead of spaces.
+        :param limit: Maximal number of results (default: all)
+        :return: Sorted list of keywords/words
+        """
+        prefix = prefix.replace('_', ' ')
+        keys = self.prefix_keys
+        start = bisect_left(keys, prefix)
+        # every string that starts with $prefix sorts before this one
+        end = bisect_left(keys, prefix + "\U0010ffff", lo=start)
+        if limit is not None:
+            end = min(end, start + limit)
+        return keys[start:end]
 
     def primitive_search(self, primitives: List[str]):
         """ Searches for kanji based on primitives.
         :param primitives:
         :return:
         """
+        self.materialize_stories()
+        if not primitives:
+            return list(self.kanjis)
+        primitives = [p.replace("_", " ") for p in primitives]
+        key = ("primitive", tuple(primitives))
+        found = self.cache.get(key)
+        stats.count("queries.primitive")
+        if found is None:
+            stats.count("cache.misses")
+            with stats.timer("search.primitive"):
+                found = tuple(kanji_obj for kanji_obj in
+                              self._substring_search(self.story_ngrams,
+                                                     "story", primitives)
+                              if kanji_obj.story)
+            self.cache.put(key, found)
+        else:
+            stats.count("cache.hits")
+        stats.count("results.kanji", len(found))
+        return list(found)
+
+    def _anagram_search(self, letters: str) -> List[Kanji]:
+        """ Returns all kanji_objs whose keywords contain every letter of
+        $letters exactly as often as $letters (and possibly other letters).
+        :param letters:
+        :return: List of kanji objects in the order of self.kanjis
+        """
+        if not letters:
+            return list(self.kanjis)
+        if not self._use_index("letter_counts"):
+            counts = Counter(letters).items()
+            return [kanji_obj for kanji_obj in self.kanjis
+                    if all(kanji_obj.keyword.count(letter) == count
+                           for letter, count in counts)]
+        postings = []
+        for letter, count in Counter(letters).items():
+            posting = self.letter_counts.get((letter, count))
+            if not posting:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        positions = set(postings[0]).intersection(*postings[1:])
+        return [self.kanjis[pos] for pos in sorted(positions)]
+
+    def _substring_search(self, ngrams: NgramIndex, attribute: str,
+                          substrings: List[str]) -> List[Kanji]:
+        """ Returns all kanji_objs where the attribute $attribute contains all
+        of $substrings.
+        :param ngrams: NgramIndex over the attribute
+        :param attribute: "keyword" or "story"
+        :param substrings:
+        :return: List of kanji objects in the order of self.kanjis
+        """
+        candidates = ngrams.candidates_all(substrings)
+        if candidates is None:
+            kanji_objs = self.kanjis
+        else:
+            kanji_objs = [self.kanjis[pos] for pos in sorted(candidates)]
         results = []
-        for kanji_obj in self.kanjis:
-            found = True
-            for p in primitives:
-                if kanji_obj.story:
-                    if not p.replace("_", " ") in kanji_obj.story:
-                        found = False
-                else:
-                    found = False
-            if found:
+        for kanji_obj in kanji_objs:
+            text = getattr(kanji_obj, attribute)
+            if all(substring in text for substring in substrings):
                 results.append(kanji_obj)
         return results
 
+    def kanji_from_token(self, token: str) -> List[Kanji]:
+        """Returns all kanji_objs whose keyword contains the word $token.
+        :param token: single word
+        :return: New list of kanji objects in the order of self.kanjis
+        """
+        # a copy, so that callers can't modify the index
+        return list(self.token_to_objs.get(token, ()))
+
     def kanji_obj_from_kanji(self, kanji: str):
         """Returns kanji_obj corresponding to kanji $kanji.
         :param kanji
-        :return None
+        :return kanji object or None
         """
-        pos = self.pos_from_kanji(kanji)
+        pos = self.kanji_to_pos.get(kanji)
         if pos is not None:
             return self.kanjis[pos]
         else:
@@ -1,45 +1,41 @@
 #!/usr/bin/python3
 # -*- coding: utf8 -*-
 
-""" Tries to import the colorama module, otherwise defines colorama = None.
+""" Tries to import the colorama module, otherwise get_colorama returns None.
 Also defines function to help with color related issues.
+The import is deferred until colors are actually needed.
 """
 
-import re
-import colorama
-colorama.init()
+from rtklookup.width import strip_ansi
+
+
+_colorama = None
+_colorama_loaded = False
+
+
+def get_colorama():
+    """ Imports and initializes colorama on first use.
+    :return: colorama module or None if it is not installed.
+    """
+    global _colorama, _colorama_loaded
+    if not _colorama_loaded:
+        _colorama_loaded = True
+        try:
+            import colorama
+        except ImportError:
+            colorama = None
+        else:
+            # Whether to use colors at all is decided by us (--color), so
+            # colorama may only convert the escape sequences for legacy
+            # Windows consoles, but must never strip them.
+            colorama.init(strip=False)
+        _colorama = colorama
+    return _colorama
 
 
 def remove_color(string: str) -> str:
     """ Removes all formatting (i.e. escape sequences) from input string.
-    Useful for getting the display length of a string.
-    If colorama is not installed, returns string as it is.
     :param string: string possibly containing colorama formatting sequences.
     :return:
     """
-
-    # todo: can't I just remove all escape sequenes?
-    # or will that not work on windows?
-    # 1. get all formatting sequences
-    color_name_list = ["BLACK", "RED", "GREEN", "YELLOW", "BLUE", "MAGENTA",
-                       "CYAN", "WHITE", "RESET", "BLACK", "RED", "GREEN",
-                       "YELLOW", "BLUE", "MAGENTA", "CYAN", "WHITE", "RESET", ]
-    style_name_list = ["DIM", "NORMAL", "BRIGHT", "RESET_ALL"]
-
-    fore_color_list = \
-        [getattr(colorama.Fore, color) for color in color_name_list]
-    back_color_list = \
-        [getattr(colorama.Back, color) for color in color_name_list]
-    style_list = [getattr(colorama.Style, style) for style in style_name_list]
-
-    formatting_sequence_list = fore_color_list + back_color_list + style_list
-
-    # 2. escape them and build a regular expression that searches for
-    # everything but them
-    escaped_formatting_sequence_list = \
-        [re.escape(item) for item in formatting_sequence_list]
-    not_formatting_sequence_regex = \
-        re.compile("[^{}]".format(''.join(escaped_formatting_sequence_list)))
-
-    # 3. join the search results and return
-    return ''.join(not_formatting_sequence_regex.findall(string))
+    return strip_ansi(string)
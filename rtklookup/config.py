@@ -4,13 +4,13 @@
 import configparser
 import os.path
 from rtklookup.log import logger
-from pkg_resources import resource_filename
+from rtklookup.resources import resource_filename
 
 
 config = configparser.ConfigParser()
 # allow dynamic stuff:
 config._interpolation = configparser.ExtendedInterpolation()
-config_files = [resource_filename('rtklookup', 'config/default.config')]
+config_files = [resource_filename('config/default.config')]
 
 
 def load_config():
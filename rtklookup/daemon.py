@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+""" Lookup daemon: Loads the KanjiCollection once and answers queries over a
+unix domain socket, so that subsequent calls of 'rtk' only need to start
+a thin client.
+
+Protocol: The client sends one query per line (same grammar as the
+command line user interface). For every query, the server answers with one
+line containing a json object {"output": "..."} that holds everything the
+command line user interface would have printed.
+Every connection has its own LookupCli, so mode changes only affect the
+connection they were made in. Connections are served in parallel.
+
+Only the user who started the daemon may connect: The socket lives in a
+directory that nobody else can write to, and clients only talk to a socket
+owned by themselves (else anybody could answer their lookups).
+"""
+
+import io
+import os
+import os.path
+import sys
+import json
+import stat
+import signal
+import socket
+import socketserver
+from typing import List, Optional
+from rtklookup.log import logger
+from rtklookup.config import config
+
+
+# seconds a client waits for the daemon before looking up by itself
+DEFAULT_TIMEOUT = 5.
+
+
+def socket_path() -> str:
+    """ Path of the socket. Falls back to $XDG_RUNTIME_DIR/rtklookup.sock or
+    a socket in a private directory in the temporary directory. """
+    path = config.get("daemon", "socket", fallback="").strip()
+    if path:
+        return os.path.expanduser(path)
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "rtklookup.sock")
+    return os.path.join(os.environ.get("TMPDIR", "/tmp"),
+                        "rtklookup-{}".format(os.getuid()), "rtklookup.sock")
+
+
+def is_private_dir(path: str) -> bool:
+    """ Is $path a directory of the user that nobody else can write to? """
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(info.st_mode) and info.st_uid == os.getuid() and \
+        not info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def is_trusted_socket(path: str) -> bool:
+    """ Was the socket $path created by the user in a directory that nobody
+    else can write to (so that nobody else can replace it)? """
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(info.st_mode) and info.st_uid == os.getuid() and \
+        is_private_dir(os.path.dirname(os.path.abspath(path)))
+
+
+def available() -> bool:
+    """ Are unix domain sockets supported on this system? """
+    return hasattr(socket, "AF_UNIX")
+
+
+class LookupRequestHandler(socketserver.StreamRequestHandler):
+    """ Handles one client connection. """
+    def handle(self):
+        # avoid circular import
+        from rtklookup.ui import LookupCli
+
+        out = io.StringIO()
+        cli = LookupCli(self.server.kanji_collection, stdout=out)
+        for line in self.rfile:
+            query = line.decode("utf-8").rstrip("\n")
+            try:
+                cli.default(query)
+            except SystemExit:
+                # e.g. '.q'
+                break
+            except Exception as e:
+                logger.error("Failed to handle query '{}': {}".format(
+                    query, e))
+            response = json.dumps({"output": out.getvalue()},
+                                  ensure_ascii=False) + "\n"
+            out.seek(0)
+            out.truncate()
+            self.wfile.write(response.encode("utf-8"))
+            self.wfile.flush()
+
+
+class LookupServer(socketserver.ThreadingMixIn,
+                   socketserver.UnixStreamServer):
+    """ Serves every connection in its own thread. All threads share the
+    same KanjiCollection. """
+    daemon_threads = True
+
+    def __init__(self, path: str, kanji_collection):
+        self.kanji_collection = kanji_collection
+        super().__init__(path, LookupRequestHandler)
+
+
+def serve(kanji_collection, path=None):
+    """ Run the daemon (blocks until interrupted).
+    :param kanji_collection: Loaded KanjiCollection
+    :param path: Path of the socket (default: socket_path())
+    :return: None
+    """
+    if path is None:
+        path = socket_path()
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(directory):
+        os.makedirs(directory, mode=0o700)
+    if not is_private_dir(directory):
+        logger.critical("Not starting the daemon: Others can write to {} "
+                        "(or it isn't yours).".format(directory))
+        return
+    if os.path.lexists(path):
+        if query(["."], path) is not None:
+            logger.critical("Daemon already running at {}.".format(path))
+            return
+        # left over from a daemon that wasn't shut down properly
+        os.unlink(path)
+
+    # only the user may connect
+    old_umask = os.umask(0o077)
+    try:
+        server = LookupServer(path, kanji_collection)
+    finally:
+        os.umask(old_umask)
+    logger.info("Listening on {}.".format(path))
+    # make sure the socket is removed when we are terminated
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+
+def query(queries: List[str], path=None, timeout=None) \
+        -> Optional[List[str]]:
+    """ Send queries to a running daemon.
+    :param queries: Queries (one line of user input each)
+    :param path: Path of the socket (default: socket_path())
+    :param timeout: Seconds to wait for the daemon (per operation).
+        Default: from config
+    :return: The output for every query or None if no (trusted) daemon is
+        reachable or it doesn't answer in time.
+    """
+    if not available():
+        return None
+    if path is None:
+        path = socket_path()
+    if not is_trusted_socket(path):
+        if os.path.lexists(path):
+            logger.warning("Ignoring daemon socket {}: It isn't yours or "
+                           "others can write to its directory.".format(path))
+        return None
+    if timeout is None:
+        timeout = config.getfloat("daemon", "timeout",
+                                  fallback=DEFAULT_TIMEOUT)
+    outputs = []
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            with sock.makefile("rwb") as stream:
+                for q in queries:
+                    stream.write(q.replace("\n", " ").encode("utf-8") + b"\n")
+                    stream.flush()
+                    response = stream.readline()
+                    if not response:
+                        # connection closed, e.g. after '.q'
+                        break
+                    outputs.append(json.loads(response.decode("utf-8"))[
+                        "output"])
+    except OSError:
+        return None
+    return outputs
@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+""" Index for fuzzy searches (e.g. to find keywords with typos).
+Uses the symmetric delete approach: Every key is stored together with all
+strings that can be obtained from it by deleting up to $max_distance
+characters. If two strings are within edit distance k, they have such a
+deletion variant in common, so looking up the deletion variants of the
+query yields all candidates, which are then verified with the actual edit
+distance. No distances to keys that don't share a variant are ever computed.
+"""
+
+from typing import Dict, List, Set, Tuple, Iterable
+
+
+MAX_DISTANCE = 2
+# one typo per this many characters of the query
+CHARS_PER_EDIT = 4
+
+
+def deletion_variants(word: str, max_deletes: int) -> Set[str]:
+    """ All strings that can be obtained from $word by deleting up to
+    $max_deletes characters (including $word itself). """
+    variants = {word}
+    frontier = {word}
+    for _ in range(max_deletes):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier
+                    for i in range(len(variant))}
+        variants |= frontier
+    return variants
+
+
+def edit_distance(a: str, b: str, max_distance=None) -> int:
+    """ Edit distance with insertions, deletions, substitutions and
+    transpositions of adjacent characters (optimal string alignment).
+    :param a:
+    :param b:
+    :param max_distance: Stop early once the distance is known to be
+        larger, in which case max_distance + 1 is returned.
+    :return: Distance
+    """
+    if a == b:
+        return 0
+    if max_distance is not None and abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous2 = None  # type: List[int]
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1,
+                             current[j - 1] + 1,
+                             previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and \
+                    a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if max_distance is not None and min(current) > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return previous[len(b)]
+
+
+def default_distance(query: str, max_distance=MAX_DISTANCE) -> int:
+    """ One edit per CHARS_PER_EDIT characters of $query (at least one), at
+    most $max_distance. """
+    return min(max(1, len(query) // CHARS_PER_EDIT), max_distance)
+
+
+def scan(keys: Iterable[str], query: str, max_distance=None) \
+        -> List[Tuple[int, str]]:
+    """ Like FuzzyIndex.search, but computes the distance to every key.
+    Faster than building a FuzzyIndex for only a few searches.
+    :param keys: Strings to be searched
+    :param query:
+    :param max_distance: Default: see default_distance
+    :return: List of (distance, key) tuples, closest keys first (keys with
+        the same distance in the order of $keys).
+    """
+    if max_distance is None:
+        max_distance = default_distance(query)
+    found = []
+    for key_id, key in enumerate(keys):
+        if abs(len(key) - len(query)) > max_distance:
+            continue
+        distance = edit_distance(query, key, max_distance)
+        if distance <= max_distance:
+            found.append((distance, key_id, key))
+    found.sort()
+    return [(distance, key) for distance, _, key in found]
+
+
+class FuzzyIndex(object):
+    """ Finds all keys within a given edit distance of a query. """
+    def __init__(self, keys: Iterable[str], max_distance=MAX_DISTANCE):
+        """
+        :param keys: Strings to be searched (e.g. keywords)
+        :param max_distance: Largest edit distance that can be searched for.
+        """
+        self.max_distance = max_distance
+        self.keys = []  # type: List[str]
+        # deletion variant to the ids (positions in self.keys) of the keys
+        self.variants = {}  # type: Dict[str, List[int]]
+        for key in keys:
+            self.add(key)
+
+    def add(self, key: str):
+        key_id = len(self.keys)
+        self.keys.append(key)
+        variants = self.variants
+        for variant in deletion_variants(key, self.max_distance):
+            if variant in variants:
+                variants[variant].append(key_id)
+            else:
+                variants[variant] = [key_id]
+
+    def search(self, query: str, max_distance=None) -> List[Tuple[int, str]]:
+        """ All keys within edit distance $max_distance of $query.
+        :param query:
+        :param max_distance: Default: One edit per CHARS_PER_EDIT characters
+            of $query (at least one). At most self.max_distance.
+        :return: List of (distance, key) tuples, closest keys first (keys
+            with the same distance in the order they were added).
+        """
+        if max_distance is None:
+            max_distance = default_distance(query, self.max_distance)
+        max_distance = min(max_distance, self.max_distance)
+        candidates = set()
+        for variant in deletion_variants(query, max_distance):
+            candidates.update(self.variants.get(variant, ()))
+        found = []
+        for key_id in candidates:
+            key = self.keys[key_id]
+            distance = edit_distance(query, key, max_distance)
+            if distance <= max_distance:
+                found.append((distance, key_id))
+        found.sort()
+        return [(distance, self.keys[key_id]) for distance, key_id in found]
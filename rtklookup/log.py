@@ -4,13 +4,45 @@
 """ Quickly sets up a log.
 """
 
-import colorlog
 import logging
 
 
-logger = colorlog.getLogger("lookup")
+class LazyColoredFormatter(logging.Formatter):
+    """ colorlog.ColoredFormatter, but colorlog is only imported once the
+    first message is actually logged (usually never for a quick lookup).
+    If $stream is not a terminal (e.g. '2>file'), no colors are used.
+    """
+    def __init__(self, fmt: str, log_colors: dict, stream=None):
+        super().__init__()
+        self._fmt_string = fmt
+        self._log_colors = log_colors
+        self._stream = stream
+        self._formatter = None
+
+    def _isatty(self) -> bool:
+        try:
+            return self._stream is not None and self._stream.isatty()
+        except (AttributeError, ValueError):
+            # not a file or already closed
+            return False
+
+    def format(self, record):
+        if self._formatter is None:
+            if self._isatty():
+                import colorlog
+                self._formatter = colorlog.ColoredFormatter(
+                    self._fmt_string,
+                    log_colors=self._log_colors,
+                )
+            else:
+                self._formatter = logging.Formatter(
+                    self._fmt_string.replace("%(log_color)s", ""))
+        return self._formatter.format(record)
+
+
+logger = logging.getLogger("lookup")
 logger.setLevel(logging.DEBUG)
-sh = colorlog.StreamHandler()
+sh = logging.StreamHandler()
 sh.setLevel(logging.DEBUG)
 log_colors = {
     "DEBUG": "cyan",
@@ -19,9 +51,10 @@ log_colors = {
     "ERROR": "red",
     "CRITICAL": "red",
 }
-fm = colorlog.ColoredFormatter(
+fm = LazyColoredFormatter(
     "%(log_color)s%(name)s:%(levelname)s:%(message)s",
     log_colors=log_colors,
+    stream=sh.stream,
 )
 sh.setFormatter(fm)
 logger.addHandler(sh)
@@ -10,30 +10,57 @@ import os
 import sys
 import logging
 import signal
-from rtklookup.ui import LookupCli
-from rtklookup.collection import KanjiCollection
 from rtklookup.log import logger
 from rtklookup.config import load_config
 from rtklookup import handler
+from rtklookup import daemon
 import argparse
+# Note: The remaining modules are only imported in main() if no daemon
+# answers the queries, to keep the client fast.
 
 def create_parser():
     parser = argparse.ArgumentParser(prog='rtk', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('--verbose', '-v', action='store_true', help='Verbosity')
     parser.add_argument('keywords', metavar='N', nargs='*', help='Keywords used to lookup')
+    parser.add_argument('--input', '-i', type=argparse.FileType('r', encoding='utf-8'),
+                        help='Read search queries line by line from this file ("-" for stdin)')
+    parser.add_argument('--format', '-f', default='pretty',
+                        help='Output format: pretty, jsonl or tsv')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Number of processes used for --input')
+    parser.add_argument('--serve', action='store_true',
+                        help='Run as daemon that answers queries of other rtk calls')
+    parser.add_argument('--no-daemon', action='store_true',
+                        help="Don't pass the queries to a running daemon")
+    parser.add_argument('--socket', help='Socket of the daemon (default: from config)')
+    parser.add_argument('--serve-async', action='store_true',
+                        help='Run the asynchronous query server (json lines over TCP)')
+    parser.add_argument('--port', type=int, help='Port of the asynchronous query server (default: from config)')
+    parser.add_argument('--color', choices=['auto', 'always', 'never'], default='auto',
+                        help='Colored output (auto: only if the output is a terminal)')
+    parser.add_argument('--edition', '-e',
+                        help='Edition of the kanji database (see the [rtk_data.<name>] config sections)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Record timings and counters and print them as json to stderr at the end')
+    parser.add_argument('--profile-output', metavar='FILE',
+                        help='Write the --profile output to FILE (cProfile data if FILE ends with .prof)')
 
     return parser
 
 def main():
     signal.signal(signal.SIGINT, lambda signal, frame: handler.exit())
     args = create_parser().parse_args()
+    # relative to the working directory of the user
+    profile_output = os.path.abspath(args.profile_output) \
+        if args.profile_output else None
+    profiling = args.profile or profile_output is not None
 
     # else the datafile will not be found if the script is called
     # from another location
     os.chdir(os.path.dirname(os.path.realpath(__file__)))
 
     if not args.verbose:
-        if args.keywords:
+        if args.keywords or args.input:
             # not running with user interface: suppress warnings
             logger.setLevel(logging.CRITICAL)
         else:
@@ -42,19 +69,113 @@ def main():
     # do this after we have properly setup the logger
     load_config()
 
+    if args.edition:
+        from rtklookup.collection import edition_names
+        if args.edition not in edition_names():
+            create_parser().error("Unknown edition {}. Available: {}".format(
+                args.edition, ", ".join(edition_names())))
+
+    if args.color == 'auto':
+        color = sys.stdout.isatty()
+    else:
+        color = args.color == 'always'
+
+    if args.keywords and not args.input and args.format == "pretty" and \
+            not args.serve and not args.serve_async and not args.no_daemon \
+            and not profiling:
+        # let a running daemon do the work
+        keywords = [keyword.lstrip() for keyword in args.keywords]
+        if args.edition:
+            keywords.insert(0, '.e ' + args.edition)
+        # the daemon doesn't know where our output goes
+        keywords.insert(0, '.color ' + ('on' if color else 'off'))
+        outputs = daemon.query(keywords, args.socket)
+        if outputs is not None:
+            if color:
+                # replaces sys.stdout on Windows
+                from rtklookup.colorama import get_colorama
+                get_colorama()
+            sys.stdout.write(''.join(
+                ("Output for '%s':\n" % keyword
+                 if not keyword.startswith('.') else "") + output
+                for keyword, output in zip(keywords, outputs)))
+            return
+
+    if not profiling:
+        run(args, color)
+        return
+
+    profiler = None
+    if profile_output and profile_output.endswith('.prof'):
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        from rtklookup.stats import stats
+        stats.enable()
+    try:
+        run(args, color)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_output)
+        elif profile_output:
+            with open(profile_output, 'w', encoding='utf-8') as outfile:
+                outfile.write(stats.to_json() + '\n')
+        else:
+            sys.stderr.write(stats.to_json() + '\n')
+
+
+def run(args, color: bool):
+    """ Loads the collection and handles the command line arguments (unless
+    they were passed to a daemon).
+    :param args: Parsed command line arguments
+    :param color: Colored output?
+    :return: None
+    """
+    from rtklookup.ui import LookupCli
+    from rtklookup.collection import KanjiCollection
+    from rtklookup import stream
+    from rtklookup import serializer
+
+    if args.format not in serializer.FORMATS:
+        create_parser().error("Unknown output format {}".format(args.format))
+
     kanji_collection = KanjiCollection()
     logger.debug("Loading rtk data...")
     kanji_collection._load_file_rtk()
     logger.debug("Loading stories...")
     kanji_collection.load_file_stories()
+    # The user interface and the daemon get the default edition, so that
+    # they can change between all editions.
+    default_collection = kanji_collection
+    if args.edition:
+        kanji_collection = kanji_collection.edition(args.edition)
     logger.debug("Loading done.")
 
-    if not args.keywords:
+    writer = serializer.get_writer(args.format, color=color)
+
+    if args.serve:
+        daemon.serve(default_collection, args.socket)
+    elif args.serve_async:
+        from rtklookup import aioserver
+        aioserver.serve(kanji_collection, port=args.port)
+    elif args.input and args.jobs > 1:
+        from rtklookup import parallel
+        parallel.run(kanji_collection, args.input, args.format, args.jobs,
+                     color=color)
+    elif args.input:
+        stream.run(kanji_collection, args.input, writer)
+    elif args.keywords and args.format != "pretty":
+        # machine readable output: no commands, just search queries
+        stream.run(kanji_collection, args.keywords, writer)
+    elif not args.keywords:
         # No argument given > start cli interface
-        LookupCli(kanji_collection).cmdloop()
+        LookupCli(default_collection, color=color,
+                  edition=args.edition).cmdloop()
     else:
-        # future: add option to generate better parsable output
-        cli = LookupCli(kanji_collection)
+        cli = LookupCli(default_collection, color=color,
+                        edition=args.edition)
         for keyword in args.keywords:
             # else it matters whether there is a space in front of the ',':
             keyword = keyword.lstrip()
@@ -0,0 +1,333 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+""" Read-only index file of the kanji database that is used via mmap.
+Opening it takes the same (short) time no matter how large the database is
+and nothing is copied into the memory of the process: all processes that
+open the same file share one copy of it in the page cache. Useful for many
+short lived or parallel processes that only need lookups by index, keyword
+or kanji. IndexedCollection answers these lookups from the index file and
+only loads the KanjiCollection for the other search modes.
+
+Layout (little endian):
+    header      see _HEADER
+    records     one _RECORD per kanji: offset and length (in the string
+                blob) of kanji, index and keyword
+    strings     utf-8 encoded strings
+    3 tables    open addressing hash tables (FNV-1a, linear probing) for
+                the lookup by index, keyword and kanji. Every slot holds the
+                number of the record + 1 (0: empty).
+"""
+
+import os
+import os.path
+import mmap
+import struct
+from typing import List, Tuple, Optional, Iterable, Iterator
+from rtklookup.log import logger
+from rtklookup.config import config
+from rtklookup.resources import resource_filename
+from rtklookup.collection import Kanji, KanjiCollection, \
+    DEFAULT_EDITION, EDITION_SECTION_PREFIX
+from rtklookup import snapshot
+
+
+# Bump this whenever the layout changes.
+FORMAT_VERSION = 2
+MAGIC = b"RTKMMAP\0"
+# magic, format version, number of records, number of slots per table,
+# offsets of records, strings and the 3 tables, fingerprint of the source
+_HEADER = struct.Struct("<8sIIIIIIII32s")
+_RECORD = struct.Struct("<IHIHIH")
+_SLOT = struct.Struct("<I")
+
+# fields of the records
+KANJI, INDEX, KEYWORD = 0, 1, 2
+
+# search phrases ending in one of these are not supported by
+# MappedIndex.search (see KanjiCollection.search_mode)
+UNSUPPORTED_SUFFIXES = "?+%~*"
+
+Record = Tuple[str, str, str]  # kanji, index, keyword
+
+
+def fnv1a(data: bytes) -> int:
+    """ 32 bit FNV-1a hash. """
+    h = 0x811c9dc5
+    for byte in data:
+        h = ((h ^ byte) * 0x01000193) & 0xffffffff
+    return h
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def write_index(records: Iterable[Record], path: str, fingerprint=b""):
+    """ Write index file.
+    :param records: (kanji, index, keyword) tuples
+    :param path: Output file. Written atomically (temporary file first).
+    :param fingerprint: Identifies the source of the records (at most 32
+        bytes, see snapshot.fingerprint)
+    :return: None
+    """
+    import tempfile
+
+    records = list(records)
+    blob = bytearray()
+    encoded = []  # type: List[List[Tuple[int, int]]]
+    record_table = bytearray()
+    for record in records:
+        fields = []
+        for field in record:
+            data = field.encode("utf-8")
+            fields.append((len(blob), len(data)))
+            blob += data
+        encoded.append(fields)
+        record_table += _RECORD.pack(*(value for field in fields
+                                       for value in field))
+
+    # at most half full
+    table_size = 8
+    while table_size < 2 * len(records):
+        table_size *= 2
+    mask = table_size - 1
+
+    tables = []
+    for field in (INDEX, KEYWORD, KANJI):
+        slots = [0] * table_size
+        for number, fields in enumerate(encoded):
+            offset, length = fields[field]
+            key = bytes(blob[offset:offset + length])
+            slot = fnv1a(key) & mask
+            while slots[slot]:
+                other_offset, other_length = encoded[slots[slot] - 1][field]
+                if blob[other_offset:other_offset + other_length] == key:
+                    break
+                slot = (slot + 1) & mask
+            # same key: the first record wins for the index, the last one
+            # otherwise (like the dictionaries of the KanjiCollection)
+            if not slots[slot] or field != INDEX:
+                slots[slot] = number + 1
+        tables.append(struct.pack("<{}I".format(table_size), *slots))
+
+    records_offset = _align(_HEADER.size)
+    blob_offset = _align(records_offset + len(record_table))
+    table_offsets = [_align(blob_offset + len(blob))]
+    for table in tables[:-1]:
+        table_offsets.append(table_offsets[-1] + len(table))
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, len(records), table_size,
+                          records_offset, blob_offset, *table_offsets,
+                          fingerprint)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".rtkindex.")
+    try:
+        with os.fdopen(fd, "wb") as outfile:
+            for offset, data in [(0, header), (records_offset, record_table),
+                                 (blob_offset, blob)] + \
+                    list(zip(table_offsets, tables)):
+                outfile.write(b"\0" * (offset - outfile.tell()))
+                outfile.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        os.unlink(tmp_path)
+        raise
+
+
+class MappedIndex(object):
+    """ Lookups in an index file written by write_index. """
+    def __init__(self, path: str):
+        """
+        :param path: Index file
+        :raises ValueError: If the file is no valid index file.
+        """
+        self.path = path
+        with open(path, "rb") as infile:
+            self._mmap = mmap.mmap(infile.fileno(), 0,
+                                   access=mmap.ACCESS_READ)
+        if len(self._mmap) < _HEADER.size:
+            self.close()
+            raise ValueError("{} is truncated".format(path))
+        (magic, version, self._n_records, table_size, self._records_offset,
+         self._blob_offset, index_table, keyword_table, kanji_table,
+         self.fingerprint) = _HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise ValueError("{} has an unknown format".format(path))
+        self._mask = table_size - 1
+        self._tables = {INDEX: index_table, KEYWORD: keyword_table,
+                        KANJI: kanji_table}
+        if kanji_table + 4 * table_size > len(self._mmap):
+            self.close()
+            raise ValueError("{} is truncated".format(path))
+
+    def close(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self._n_records
+
+    def _field_location(self, number: int, field: int) -> Tuple[int, int]:
+        """ Offset and length of a field of a record in the file. """
+        values = _RECORD.unpack_from(
+            self._mmap, self._records_offset + number * _RECORD.size)
+        return self._blob_offset + values[2 * field], values[2 * field + 1]
+
+    def record(self, number: int) -> Record:
+        """ (kanji, index, keyword) of the record $number. """
+        if not 0 <= number < self._n_records:
+            raise IndexError(number)
+        values = _RECORD.unpack_from(
+            self._mmap, self._records_offset + number * _RECORD.size)
+        start = self._blob_offset
+        return tuple(
+            self._mmap[start + offset:start + offset + length].decode("utf-8")
+            for offset, length in zip(values[::2], values[1::2]))
+
+    def records(self) -> Iterator[Record]:
+        for number in range(self._n_records):
+            yield self.record(number)
+
+    def kanji_obj(self, number: int) -> Kanji:
+        """ Kanji object for the record $number (created on the fly). """
+        kanji, index, keyword = self.record(number)
+        kanji_obj = Kanji(kanji)
+        kanji_obj.index = index
+        kanji_obj.keyword = keyword
+        return kanji_obj
+
+    def find(self, field: int, key: str) -> Optional[int]:
+        """ Number of the record whose $field equals $key.
+        :param field: KANJI, INDEX or KEYWORD
+        :param key:
+        :return: Number of the record or None
+        """
+        key = key.encode("utf-8")
+        table = self._tables[field]
+        mm = self._mmap
+        slot = fnv1a(key) & self._mask
+        while True:
+            number = _SLOT.unpack_from(mm, table + 4 * slot)[0]
+            if not number:
+                return None
+            offset, length = self._field_location(number - 1, field)
+            if length == len(key) and mm[offset:offset + length] == key:
+                return number - 1
+            slot = (slot + 1) & self._mask
+
+    def search(self, word: str) -> Optional[List[Kanji]]:
+        """ Like KanjiCollection.search, but only for index, keyword and
+        kanji searches.
+        :param word: search phrase
+        :return: List of Kanji objects or None if $word requests another
+            kind of search (e.g. 'word?'), then KanjiCollection.search has
+            to be used.
+        """
+        word = word.replace('_', ' ')
+        if not word:
+            return []
+        if word[-1] in UNSUPPORTED_SUFFIXES:
+            return None
+        if word.isdigit():
+            number = self.find(INDEX, word)
+            if number is not None:
+                return [self.kanji_obj(number)]
+        number = self.find(KEYWORD, word)
+        if number is not None:
+            return [self.kanji_obj(number)]
+        numbers = (self.find(KANJI, letter) for letter in word)
+        return [self.kanji_obj(number) for number in numbers
+                if number is not None]
+
+
+def index_path(section: str) -> str:
+    """ Path of the index file for the config section $section (next to the
+    snapshots). """
+    return os.path.join(snapshot.snapshot_dir(), "{}.index".format(section))
+
+
+def open_index(section="rtk_data") -> Optional[MappedIndex]:
+    """ Opens the index file of the kanji database described by the config
+    section $section. If it is missing or outdated, the database is loaded
+    and the index file is written first.
+    :param section: E.g. 'rtk_data' or 'rtk_data.<edition>'
+    :return: MappedIndex or None if snapshots are disabled or the index file
+        can't be written
+    """
+    if not snapshot.enabled():
+        return None
+    filename = resource_filename(config[section]["path"])
+    path = index_path(section)
+    fingerprint = snapshot.fingerprint(filename, section)
+    try:
+        index = MappedIndex(path)
+    except (OSError, ValueError):
+        index = None
+    if index is not None:
+        if index.fingerprint == fingerprint:
+            return index
+        index.close()
+        logger.debug("Index {} is outdated.".format(path))
+
+    kanji_collection = KanjiCollection(section)
+    kanji_collection._load_file_rtk()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        kanji_collection.write_index(path, fingerprint)
+    except OSError as e:
+        logger.warning("Could not write index {}: {}".format(path, e))
+        return None
+    logger.debug("Wrote index {}.".format(path))
+    return MappedIndex(path)
+
+
+class IndexedCollection(object):
+    """ Stands in for a KanjiCollection where only search_many is needed
+    (e.g. resolve_results in worker processes): Index, keyword and kanji
+    searches are answered from the index file, the KanjiCollection is only
+    loaded once another kind of search comes along.
+    """
+    def __init__(self, edition=None):
+        """
+        :param edition: Name of the edition (default: DEFAULT_EDITION)
+        """
+        self.edition_name = edition or DEFAULT_EDITION
+        if self.edition_name == DEFAULT_EDITION:
+            section = "rtk_data"
+        else:
+            section = EDITION_SECTION_PREFIX + self.edition_name
+        self.index = open_index(section)
+        self._kanji_collection = None  # type: KanjiCollection
+
+    @property
+    def kanji_collection(self) -> KanjiCollection:
+        """ The full collection, loaded on first use. """
+        if self._kanji_collection is None:
+            kanji_collection = KanjiCollection()
+            kanji_collection.load_file_rtk()
+            kanji_collection.load_file_stories()
+            self._kanji_collection = \
+                kanji_collection.edition(self.edition_name)
+        return self._kanji_collection
+
+    def search(self, word: str) -> List[Kanji]:
+        """ See KanjiCollection.search. """
+        if not word:
+            return
+        found = None
+        if self.index is not None:
+            found = self.index.search(word)
+        if found is None:
+            found = self.kanji_collection.search(word)
+        return found
+
+    def search_many(self, words: Iterable[str]) -> List[List[Kanji]]:
+        """ See KanjiCollection.search_many. """
+        return [self.search(word) for word in words]
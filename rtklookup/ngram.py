@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+""" N-gram index to speed up substring searches over many texts.
+"""
+
+from typing import Dict, Set, Optional, Iterable
+
+
+NGRAM_LENGTH = 3
+
+
+class NgramIndex(object):
+    """ Maps every n-gram (substring of length n) to the positions of all
+    texts containing it. A text can only contain a query if it contains all
+    n-grams of the query, so intersecting their positions yields a (usually
+    small) set of candidates which then have to be verified.
+    """
+    def __init__(self, n=NGRAM_LENGTH):
+        self.n = n
+        self.postings = {}  # type: Dict[str, Set[int]]
+
+    def ngrams(self, text: str) -> Set[str]:
+        """ All n-grams of $text. """
+        return {text[i:i + self.n] for i in range(len(text) - self.n + 1)}
+
+    def add(self, pos: int, text: str):
+        """ Add text.
+        :param pos: Position of the text (e.g. in KanjiCollection.kanjis)
+        :param text:
+        :return:
+        """
+        for gram in self.ngrams(text):
+            self.postings.setdefault(gram, set()).add(pos)
+
+    def clear(self):
+        self.postings.clear()
+
+    def candidates(self, query: str) -> Optional[Set[int]]:
+        """ Positions of all texts that might contain $query.
+        :param query:
+        :return: Set of positions or None if the query is too short to
+            narrow down the texts (i.e. all texts are candidates).
+        """
+        if len(query) < self.n:
+            return None
+        postings = []
+        for gram in self.ngrams(query):
+            posting = self.postings.get(gram)
+            if not posting:
+                return set()
+            postings.append(posting)
+        # start with the rarest n-gram to keep the intermediate sets small
+        postings.sort(key=len)
+        result = set(postings[0])
+        for posting in postings[1:]:
+            result &= posting
+            if not result:
+                break
+        return result
+
+    def candidates_all(self, queries: Iterable[str]) -> Optional[Set[int]]:
+        """ Positions of all texts that might contain all of $queries.
+        :param queries:
+        :return: Set of positions or None if none of the queries narrows
+            down the texts.
+        """
+        result = None
+        for query in queries:
+            candidates = self.candidates(query)
+            if candidates is None:
+                continue
+            if result is None:
+                result = candidates
+            else:
+                result &= candidates
+            if not result:
+                break
+        return result
@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+""" Parallel version of the streaming mode (see stream.py) for very large
+inputs: Chunks of queries are resolved and formatted by a pool of worker
+processes, the output is written in the order of the input.
+
+The workers share the collection of the parent process: With the 'fork'
+start method they inherit it (copy on write), otherwise every worker maps
+the index file (see mmapindex.py), so that all of them share one copy of
+it, and only loads the collection (from the snapshot, see snapshot.py) if
+a query needs more than lookups by index, keyword or kanji.
+"""
+
+import io
+import sys
+import multiprocessing
+from collections import deque
+from typing import Iterable, List
+from rtklookup.log import logger
+from rtklookup.config import load_config
+from rtklookup.collection import KanjiCollection
+from rtklookup.mmapindex import IndexedCollection
+from rtklookup.searchresults import SearchResult, resolve_results
+from rtklookup.serializer import get_writer
+from rtklookup.stream import read_queries, chunked, exit_on_broken_pipe, \
+    CHUNK_SIZE
+
+
+# state of the worker processes
+# KanjiCollection or IndexedCollection
+_kanji_collection = None
+_format = None  # type: str
+_color = True
+
+
+def _init_worker(fmt: str, color: bool, inherited: bool, edition: str,
+                 log_level: int):
+    """ Initializes a worker process.
+    :param fmt: Output format (see serializer.FORMATS)
+    :param color: Use colors (pretty format)?
+    :param inherited: Did the worker inherit the collection from the parent?
+    :param edition: Name of the edition of the collection
+    :param log_level: Level of the logger of the parent process
+    """
+    global _kanji_collection, _format, _color
+    _format = fmt
+    _color = color
+    logger.setLevel(log_level)
+    if not inherited:
+        load_config()
+        _kanji_collection = IndexedCollection(edition)
+
+
+def _process_chunk(chunk: List[str]) -> str:
+    """ Resolves and formats a chunk of queries (in a worker process).
+    :param chunk: Queries
+    :return: Formatted output
+    """
+    results = [SearchResult.from_line(query) for query in chunk]
+    resolve_results(_kanji_collection, results)
+    out = io.StringIO()
+    get_writer(_format, out, color=_color).write_many(results)
+    return out.getvalue()
+
+
+def run(kanji_collection: KanjiCollection, lines: Iterable[str], fmt: str,
+        jobs: int, out=None, chunk_size=CHUNK_SIZE, color=True):
+    """ Reads search queries from $lines and writes the results to $out.
+    :param kanji_collection: Loaded KanjiCollection
+    :param lines: E.g. a file object
+    :param fmt: Output format (see serializer.FORMATS)
+    :param jobs: Number of worker processes
+    :param out: Writable text stream (default: sys.stdout)
+    :param chunk_size: Number of lines that are processed together.
+    :param color: Use colors (pretty format)?
+    :return: None
+    """
+    global _kanji_collection
+    if out is None:
+        out = sys.stdout
+
+    inherited = "fork" in multiprocessing.get_all_start_methods()
+    if inherited:
+        context = multiprocessing.get_context("fork")
+        # inherited by the workers
+        _kanji_collection = kanji_collection
+    else:
+        context = multiprocessing.get_context()
+
+    # Only a limited number of chunks are in flight at any time, so that
+    # memory stays bounded no matter how large the input is.
+    max_pending = 2 * jobs
+    pending = deque()
+    with context.Pool(jobs, initializer=_init_worker,
+                      initargs=(fmt, color, inherited,
+                                kanji_collection.edition_name,
+                                logger.level)) as pool:
+        try:
+            for chunk in chunked(read_queries(lines), chunk_size):
+                pending.append(pool.apply_async(_process_chunk, (chunk,)))
+                if len(pending) >= max_pending:
+                    out.write(pending.popleft().get())
+                    out.flush()
+            while pending:
+                out.write(pending.popleft().get())
+                out.flush()
+        except BrokenPipeError:
+            if out is not sys.stdout:
+                raise
+            exit_on_broken_pipe()
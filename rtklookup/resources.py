@@ -0,0 +1,21 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+""" Locate the data files that are shipped with the package.
+This replaces pkg_resources, which takes longer to import than everything
+else that is needed for a lookup.
+"""
+
+import os.path
+
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def resource_filename(path: str) -> str:
+    """ Absolute path of a file that is shipped with the package.
+    :param path: Path relative to the package directory, e.g.
+        'data/rtk_data.tsv'
+    :return: Absolute path
+    """
+    return os.path.join(PACKAGE_DIR, path)
@@ -4,34 +4,53 @@
 """ After the user made a query in the ui which built a SearchResult object
 from it, we want to print the result nicely. This is done by the ResultPrinter.
 Note that the ResultPrinter gets initialized anew for every SearchResult.
+The output is rendered into a buffer first and written with a single call.
 """
 
-from typing import List
+import sys
+from typing import List, Dict
 from collections import namedtuple
 from rtklookup.searchresults import SearchResult, SearchResultGroup
-from rtklookup.util import CyclicalList, approximate_string_length
-from rtklookup.colorama import colorama, remove_color
+from rtklookup.util import CyclicalList
+from rtklookup.colorama import get_colorama
+from rtklookup.width import WidthTracker, display_width
+from rtklookup.stats import stats
 
 
 class ResultPrinter(object):
     """ Class used to print the result of a query made by the user. """
-    def __init__(self, search_group_collection: SearchResult):
+    def __init__(self, search_group_collection: SearchResult, out=None,
+                 color=True):
         """
         :param search_group_collection: SearchItemCollection object containing
         the information about the search results.
+        :param out: Writable text stream (default: sys.stdout)
+        :param color: Use colors? If False, no escape sequences are written.
         :return:None
         """
         self.result = search_group_collection
+        self.color = color
 
         self.colors = None
         self.setup_color_set()  # sets self.colors
+        # only now: initializing colorama replaces sys.stdout (on Windows)
+        self.out = out if out is not None else sys.stdout
 
         self.first_line = ""
+        # display width of the first line (without escape sequences)
+        self.first_line_width = 0
         self.details = ""
         self.first_line_groups = []  # type: List[str]
         self.detail_groups = []  # type: List[List[str]]
 
         self._indent_all = 4
+        # rendered lines
+        self._lines = []  # type: List[str]
+
+        # position of every group among the groups of the same type and of
+        # every kanji inside of its group (computed on first use)
+        self._group_ordinals = None  # type: Dict[int, int]
+        self._item_positions = {}  # type: Dict[int, Dict[int, int]]
 
     def setup_color_set(self):
         """ Sets up the namedtuple self.colors that holds the color settings.
@@ -39,6 +58,7 @@ class ResultPrinter(object):
         """
         _colors_type = namedtuple("colors", ["kanji", "kana", "broken",
                                              "default"])
+        colorama = get_colorama() if self.color else None
         if colorama:
             self.colors = \
                 _colors_type(kanji=CyclicalList([colorama.Fore.RED,
@@ -69,7 +89,13 @@ class ResultPrinter(object):
         :return:
         """
         if group.type == "kanji":
-            return getattr(self.colors, group.type)[group.kanji.index(item)]
+            positions = self._item_positions.get(id(group))
+            if positions is None:
+                positions = {}
+                for pos, kanji in enumerate(group.kanji):
+                    positions.setdefault(id(kanji), pos)
+                self._item_positions[id(group)] = positions
+            return getattr(self.colors, group.type)[positions[id(item)]]
         else:
             return getattr(self.colors, group.type)[0]  # there's only one
 
@@ -79,18 +105,22 @@ class ResultPrinter(object):
         :param group:
         :return:
         """
-        nth = 0
-        for other in self.result:
-            if group == other:
-                return nth
-            if group.type == other.type:
-                nth += 1
+        if self._group_ordinals is None:
+            # one pass over all groups
+            self._group_ordinals = {}
+            counts = {}  # type: Dict[str, int]
+            for other in self.result.groups:
+                self._group_ordinals.setdefault(id(other),
+                                                counts.get(other.type, 0))
+                counts[other.type] = counts.get(other.type, 0) + 1
+        return self._group_ordinals.get(id(group))
 
     def format_first_line(self):
         """ Format the first line. First line will be empty if not necessary.
         """
         if self.result.is_empty:
             self.first_line = "No results"
+            self.first_line_width = display_width(self.first_line)
             return
         if self.result.mode == "primitive":
             # we always want to format the results in details style
@@ -102,27 +132,33 @@ class ResultPrinter(object):
         if self.result.is_single_kanji:
             # single kanji mode
             return
+        first_line = WidthTracker()
         for group in self.result.groups:
             if group.is_empty:
                 continue
+            color = self.group_color(group)
             if group.has_kanji:
-                group_string = ""
+                group_string = WidthTracker()
                 for kanji in group.kanji:
-                    group_string += self.group_color(group) + kanji.kanji + \
-                                    self.colors.default
-                self.first_line_groups.append(group_string)
+                    group_string.append_colored(kanji.kanji, color,
+                                                self.colors.default)
+                self.first_line_groups.append(group_string.value)
+                first_line.append(group_string.value, group_string.width)
             elif group.has_kana:
-                self.first_line_groups.append(self.group_color(group) +
-                                              group.kana + self.colors.default)
+                group_string = color + group.kana + self.colors.default
+                self.first_line_groups.append(group_string)
+                first_line.append(group_string, display_width(group.kana))
             elif group.is_broken:
                 # display kana try
-                self.first_line_groups.append(self.group_color(group) +
-                                              group.kana + self.colors.default)
+                group_string = color + group.kana + self.colors.default
+                self.first_line_groups.append(group_string)
+                first_line.append(group_string, display_width(group.kana))
             else:
                 raise ValueError
 
         # if group length > 1 add symbols
-        self.first_line = ''.join(self.first_line_groups)
+        self.first_line = first_line.value
+        self.first_line_width = first_line.width
 
     def format_details(self):
         """ Format the detail block. Detail block will be empty if not
@@ -146,40 +182,48 @@ class ResultPrinter(object):
                 self.detail_groups.append(details)
 
     def print_line(self, line: str):
-        """ Wrapper around normal print() function to implement indenting and such.
+        """ Adds a line to the output (with indentation).
         :param line:
         """
-        print(" " * self._indent_all + line)
+        self._lines.append(" " * self._indent_all + line + "\n")
 
     def print_divider(self, char: str):
-        """ Prints dividing line.
+        """ Adds a dividing line to the output.
         :param char: The character/string used.
         :return:
         """
-        divider = char * approximate_string_length(self.first_line)
+        divider = char * self.first_line_width
         self.print_line(divider)
 
+    def render(self) -> str:
+        """ Format the result.
+        :return: Everything that print() writes.
+        """
+        with stats.timer("format"):
+            self._lines = ["\n"]
+            self.format_first_line()
+            self.format_details()
+            self.print_first_line()
+            if self.first_line_width and self.detail_groups:
+                self.print_divider("\u2500")
+            self.print_details()
+            self._lines.append("\n")
+            return "".join(self._lines)
+
     def print(self):
         """ Print the result. "Main" function.
         :return:
         """
-        print()
-        self.format_first_line()
-        self.format_details()
-        self.print_first_line()
-        if remove_color(self.first_line) and self.detail_groups:
-            self.print_divider("\u2500")
-        self.print_details()
-        print()
+        self.out.write(self.render())
 
     def print_first_line(self):
-        """Print first line. """
+        """Add first line to the output. """
         if self.first_line:
             # if needed to avoid line break if self.first_line is empty
             self.print_line(self.first_line)
 
     def print_details(self):
-        """ Print details block. """
+        """ Add details block to the output. """
         for group_no, group in enumerate(self.detail_groups):
             for item in group:
                 self.print_line(item)
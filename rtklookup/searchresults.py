@@ -10,22 +10,65 @@ SeachResultGroups represents the result of the whole search.
 
 from typing import List
 import re
-from rtklookup.collection import Kanji
-import romkan
+from functools import lru_cache
+from rtklookup.collection import Kanji, KanjiCollection
+from rtklookup.stats import stats
+
+
+# anything that is not hiragana or katakana
+_NON_KANA_REGEX = re.compile("[^\u3040-\u30ff]")
+
+
+def is_kana(string: str) -> bool:
+    """ Does $string consist of hiragana and katakana only? """
+    return not _NON_KANA_REGEX.search(string)
+
+
+@lru_cache(maxsize=4096)
+def to_hiragana(string: str) -> str:
+    """ Converts romaji to hiragana. romkan is imported on first use, as
+    importing it takes a while. The conversion is slow, so the results are
+    cached.
+    """
+    import romkan
+    return romkan.to_hiragana(string)
 
 
 class SearchResultGroup(object):
     """ This type holds a single search query and its results.
+    The conversion to kana and the classification of the group are computed
+    on first access and cached.
     """
+    wildcards = ['%', '+', '*', '?', '~']
+
     def __init__(self, search_string: str):
         self.search = search_string  # type: str
+        self._kana = None  # type: str
+        self._has_kana = None  # type: bool
         self.kanji = []  # type: List[Kanji]
-        self.kana = self.search
-        self.wildcards = ['%', '+', '*', '?']
-        if not self.has_kana:
-            # checking for self.has_kana to avoid converting hiragana
-            # and such to kana.
-            self.kana = romkan.to_hiragana(self.search)
+
+    @property
+    def kanji(self) -> List[Kanji]:
+        return self._kanji
+
+    @kanji.setter
+    def kanji(self, kanji: List[Kanji]):
+        self._kanji = kanji
+        # classification depends on the kanji
+        self._type = None
+        self._needs_details = None
+
+    @property
+    def kana(self) -> str:
+        """ The search string converted to hiragana (where possible). """
+        if self._kana is None:
+            if is_kana(self.search):
+                # avoid converting hiragana and such to kana.
+                self._kana = self.search
+            else:
+                with stats.timer("kana"):
+                    self._kana = to_hiragana(self.search)
+        return self._kana
 
     @property
     def is_empty(self):
@@ -39,10 +82,9 @@ class SearchResultGroup(object):
         """ Could we successfully convert to hiragana?
         :return:
         """
-        if re.search("[^\u3040-\u30ff]", self.kana):
-            return False
-        else:
-            return True
+        if self._has_kana is None:
+            self._has_kana = is_kana(self.kana)
+        return self._has_kana
 
     @property
     def has_kanji(self):
@@ -80,12 +122,10 @@ class SearchResultGroup(object):
         or if the search contained some kind of wildcard character.
         :return:
         """
-        if not self.is_unique:
-            return True
-        for wc in self.wildcards:
-            if wc in self.search:
-                return True
-        return False
+        if self._needs_details is None:
+            self._needs_details = not self.is_unique or \
+                any(wc in self.search for wc in self.wildcards)
+        return self._needs_details
 
     @property
     def type(self):
@@ -93,12 +133,14 @@ class SearchResultGroup(object):
         also found kanji, "kanji" is returned.
         :return: "kanji" "kana" or "broken"
         """
-        if self.has_kanji:
-            return "kanji"
-        elif self.has_kana:
-            return "kana"
-        elif self.is_broken:
-            return "broken"
+        if self._type is None:
+            if self.has_kanji:
+                self._type = "kanji"
+            elif self.has_kana:
+                self._type = "kana"
+            elif self.is_broken:
+                self._type = "broken"
+        return self._type
 
     def __str__(self):
         return "<{} object for search '{}'>".format(self.__class__.__name__,
@@ -121,6 +163,19 @@ class SearchResult(object):
         self.groups = []  # type: List[SearchResultGroup]
         self.mode = mode  # the mode which was used for the search
 
+    @classmethod
+    def from_line(cls, line: str, mode=None):
+        """ SearchResult with one (not yet resolved) SearchResultGroup for
+        every search word of $line.
+        :param line: The whole search query
+        :param mode: the mode which is used for the search
+        :return: SearchResult
+        """
+        result = cls(line, mode=mode)
+        result.groups = [SearchResultGroup(search_word)
+                         for search_word in line.split(' ')]
+        return result
+
     def copyable_result(self) -> str:
         """If the user is desperate to search for the result online or copy
         it for some similar person, this returns our best guess for such a
@@ -194,3 +249,17 @@ class SearchResult(object):
 
     def __getitem__(self, item: int) -> SearchResultGroup:
         return self.groups[item]
+
+
+def resolve_results(kanji_collection: KanjiCollection,
+                    results: List[SearchResult]):
+    """ Looks up the kanji for all groups of all $results with a single call
+    to KanjiCollection.search_many.
+    :param kanji_collection:
+    :param results:
+    :return: None
+    """
+    groups = [group for result in results for group in result.groups]
+    found = kanji_collection.search_many([group.search for group in groups])
+    for group, kanji in zip(groups, found):
+        group.kanji = kanji
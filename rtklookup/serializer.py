@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+""" Machine readable output: Writes SearchResults as json lines or tab
+separated values directly, without going through the ResultPrinter.
+"""
+
+import sys
+import json
+from typing import List
+from rtklookup.searchresults import SearchResult, SearchResultGroup
+from rtklookup.resultprinter import ResultPrinter
+from rtklookup.colorama import get_colorama
+from rtklookup.stats import stats
+
+
+# available output formats (first one is the default)
+FORMATS = ["pretty", "jsonl", "tsv"]
+
+
+def group_to_dict(group: SearchResultGroup) -> dict:
+    """ Plain dictionary with the content of a SearchResultGroup. The kana
+    are only included if the conversion to kana succeeded. """
+    return {
+        "search": group.search,
+        "type": group.type,
+        "kana": group.kana if group.has_kana else None,
+        "kanji": [{"kanji": kanji.kanji,
+                   "index": kanji.index,
+                   "keyword": kanji.keyword} for kanji in group.kanji or []],
+    }
+
+
+def result_to_dict(result: SearchResult) -> dict:
+    """ Plain dictionary with the content of a SearchResult. """
+    return {
+        "search": result.search,
+        "result": result.copyable_result(),
+        "groups": [group_to_dict(group) for group in result.groups],
+    }
+
+
+class Writer(object):
+    """ Writes SearchResults to a text stream. Subclasses implement
+    format_result. All results passed to write_many are written with a single
+    call to the stream's write method.
+    """
+    def __init__(self, out=None):
+        """
+        :param out: Writable text stream (default: sys.stdout)
+        """
+        self.out = out if out is not None else sys.stdout
+
+    def format_result(self, result: SearchResult) -> str:
+        raise NotImplementedError
+
+    def write_many(self, results: List[SearchResult]):
+        with stats.timer("write"):
+            self.out.write(''.join(self.format_result(result)
+                                   for result in results))
+
+    def write(self, result: SearchResult):
+        self.write_many([result])
+
+    def flush(self):
+        self.out.flush()
+
+
+class JsonlWriter(Writer):
+    """ One json object per SearchResult and line. """
+    def format_result(self, result: SearchResult) -> str:
+        return json.dumps(result_to_dict(result), ensure_ascii=False) + "\n"
+
+
+class TsvWriter(Writer):
+    """ One line per SearchResultGroup with the columns
+    query, search word, type, kanji, indices, keywords, kana.
+    Several kanji/indices/keywords are separated by ',' (keywords by ';').
+    """
+    @staticmethod
+    def _field(value: str) -> str:
+        return value.replace("\t", " ").replace("\n", " ")
+
+    def format_result(self, result: SearchResult) -> str:
+        lines = []
+        for group in result.groups:
+            kanji = group.kanji or []
+            lines.append('\t'.join(self._field(field) for field in [
+                result.search,
+                group.search,
+                group.type,
+                ''.join(k.kanji for k in kanji),
+                ','.join(k.index for k in kanji),
+                ';'.join(k.keyword for k in kanji),
+                group.kana if group.has_kana else "",
+            ]) + "\n")
+        return ''.join(lines)
+
+
+class PrettyWriter(Writer):
+    """ Human readable output with the ResultPrinter. """
+    def __init__(self, out=None, color=True):
+        """
+        :param out: Writable text stream (default: sys.stdout)
+        :param color: Use colors?
+        """
+        if color and out is None:
+            # initializing colorama replaces sys.stdout (on Windows)
+            get_colorama()
+        super().__init__(out)
+        self.color = color
+
+    def format_result(self, result: SearchResult) -> str:
+        return "Output for '%s':\n" % result.search + \
+            ResultPrinter(result, out=self.out, color=self.color).render()
+
+
+def get_writer(fmt: str, out=None, color=True) -> Writer:
+    """ Writer for the output format $fmt (one of FORMATS).
+    :param fmt: Output format
+    :param out: Writable text stream (default: sys.stdout)
+    :param color: Use colors? (only relevant for the pretty format)
+    :return: Writer
+    """
+    if fmt == "pretty":
+        return PrettyWriter(out, color=color)
+    writers = {
+        "jsonl": JsonlWriter,
+        "tsv": TsvWriter,
+    }
+    return writers[fmt](out)
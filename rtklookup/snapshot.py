@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+""" Binary snapshot of the parsed kanji database.
+Parsing data/rtk_data.tsv on every start is slow compared to the rest of
+a single lookup, so after the first parse the records are dumped into a
+cache file which is loaded directly on the next start.
+The snapshot is versioned and checksummed and it is discarded as soon as
+the data file or the relevant configuration changes.
+"""
+
+import os
+import os.path
+import sys
+import marshal
+import hashlib
+import struct
+from typing import List, Tuple, Optional
+from rtklookup.log import logger
+from rtklookup.config import config
+
+
+# Bump this whenever the layout of the payload changes.
+FORMAT_VERSION = 1
+MAGIC = b"RTKSNAP\0"
+# magic, format version, fingerprint of the source, checksum of the payload
+_HEADER = struct.Struct("<8sI32s32s")
+
+Record = Tuple[str, str, str]  # kanji, index, keyword
+
+
+def enabled() -> bool:
+    """ Should we use snapshots at all? """
+    return config.getboolean("snapshot", "enabled", fallback=True)
+
+
+def snapshot_dir() -> str:
+    """ Directory the snapshots are written to. Falls back to
+    $XDG_CACHE_HOME/rtklookup (i.e. ~/.cache/rtklookup).
+    """
+    directory = config.get("snapshot", "dir", fallback="").strip()
+    if not directory:
+        cache_home = os.environ.get("XDG_CACHE_HOME") or \
+            os.path.join(os.path.expanduser("~"), ".cache")
+        directory = os.path.join(cache_home, "rtklookup")
+    return os.path.expanduser(directory)
+
+
+def snapshot_path(name: str) -> str:
+    """ Path of the snapshot file for the data set $name. """
+    return os.path.join(snapshot_dir(), "{}.snapshot".format(name))
+
+
+def fingerprint(filename: str, section: str) -> bytes:
+    """ Identifies the exact input a snapshot was built from: The data file
+    (path, size and modification time), the configuration section used to
+    parse it and the python version (marshal format).
+    :param filename: Data file
+    :param section: Name of the config section describing the data file
+    :return: sha256 digest
+    """
+    stat = os.stat(filename)
+    key = repr((
+        FORMAT_VERSION,
+        marshal.version,
+        sys.version_info[:2],
+        os.path.abspath(filename),
+        stat.st_size,
+        stat.st_mtime_ns,
+        sorted(config.items(section)),
+    ))
+    return hashlib.sha256(key.encode("utf-8")).digest()
+
+
+def load(name: str, filename: str, section: str) -> Optional[List[Record]]:
+    """ Load the records from the snapshot.
+    :param name: Name of the data set
+    :param filename: Data file the snapshot was built from
+    :param section: Name of the config section describing the data file
+    :return: List of records or None if there is no valid snapshot.
+    """
+    path = snapshot_path(name)
+    try:
+        with open(path, "rb") as snapshot_file:
+            data = snapshot_file.read()
+    except OSError:
+        return None
+
+    if len(data) < _HEADER.size:
+        logger.debug("Snapshot {} truncated, ignoring it.".format(path))
+        return None
+    magic, version, source, checksum = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        logger.debug("Snapshot {} has unknown format.".format(path))
+        return None
+    if source != fingerprint(filename, section):
+        logger.debug("Snapshot {} is outdated.".format(path))
+        return None
+    payload = data[_HEADER.size:]
+    if hashlib.sha256(payload).digest() != checksum:
+        logger.warning("Snapshot {} is corrupt, ignoring it.".format(path))
+        return None
+
+    try:
+        return marshal.loads(payload)
+    except (ValueError, EOFError, TypeError):
+        logger.warning("Snapshot {} could not be read.".format(path))
+        return None
+
+
+def save(name: str, filename: str, section: str,
+         records: List[Record]) -> bool:
+    """ Write snapshot. Failing to do so is not fatal.
+    :param name: Name of the data set
+    :param filename: Data file the records were parsed from
+    :param section: Name of the config section describing the data file
+    :param records: The parsed records
+    :return: True if the snapshot was written.
+    """
+    # only needed when writing
+    import tempfile
+
+    payload = marshal.dumps(records)
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION,
+                          fingerprint(filename, section),
+                          hashlib.sha256(payload).digest())
+    path = snapshot_path(name)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first, so that concurrent processes
+        # never see a half written snapshot
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                        prefix=".{}.".format(name))
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                tmp_file.write(header)
+                tmp_file.write(payload)
+            os.replace(tmp_path, path)
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        logger.debug("Could not write snapshot {}: {}".format(path, e))
+        return False
+    logger.debug("Wrote snapshot {}.".format(path))
+    return True
@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+""" Opt-in instrumentation: Timings of the stages (loading, searching,
+kana conversion, formatting) and counters (queries by search mode, cache
+hits, result sizes).
+Disabled by default; then timers and counters cost next to nothing.
+Enable with 'rtk --profile' or '.stats on' in the command line user
+interface.
+"""
+
+import json
+import threading
+from time import perf_counter
+from typing import Dict, List
+
+
+class _Timer(object):
+    """ Context manager that adds the time spent inside of it to a stage. """
+    __slots__ = ("_stats", "_name", "_start")
+
+    def __init__(self, stats, name: str):
+        self._stats = stats
+        self._name = name
+        self._start = 0.
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stats.add_time(self._name, perf_counter() - self._start)
+        return False
+
+
+class _NullTimer(object):
+    """ Timer used while the instrumentation is disabled. """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Stats(object):
+    """ Collects timings and counters. Can be shared between threads. """
+    def __init__(self):
+        self.enabled = False
+        # stage name: [number of calls, total time in seconds]
+        self.timings = {}  # type: Dict[str, List]
+        self.counters = {}  # type: Dict[str, int]
+        self._lock = threading.Lock()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        """ Drops all timings and counters. """
+        with self._lock:
+            self.timings.clear()
+            self.counters.clear()
+
+    def timer(self, name: str):
+        """ Context manager that records the time spent in the stage $name,
+        e.g.
+            with stats.timer("search"):
+                ...
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def add_time(self, name: str, seconds: float):
+        with self._lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                self.timings[name] = [1, seconds]
+            else:
+                timing[0] += 1
+                timing[1] += seconds
+
+    def count(self, name: str, n=1):
+        """ Increases the counter $name by $n (if enabled). """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self) -> dict:
+        """ Timings (in seconds) and counters as plain dictionary. """
+        with self._lock:
+            return {
+                "timings": {
+                    name: {"calls": calls, "total": total,
+                           "mean": total / calls}
+                    for name, (calls, total) in sorted(self.timings.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def to_json(self, **extra) -> str:
+        """ Timings and counters as json.
+        :param extra: Further entries of the top level object, e.g. the
+            statistics of the cache.
+        :return: json string
+        """
+        data = self.as_dict()
+        data.update(extra)
+        return json.dumps(data, indent=2, ensure_ascii=False)
+
+    def summary(self) -> str:
+        """ Human readable table of the timings and counters. """
+        lines = []
+        data = self.as_dict()
+        if data["timings"]:
+            lines.append("{:<24} {:>8} {:>12} {:>12}".format(
+                "stage", "calls", "total [ms]", "mean [ms]"))
+            for name, timing in data["timings"].items():
+                lines.append("{:<24} {:>8} {:>12.3f} {:>12.3f}".format(
+                    name, timing["calls"], 1000 * timing["total"],
+                    1000 * timing["mean"]))
+        if data["counters"]:
+            if lines:
+                lines.append("")
+            for name, value in data["counters"].items():
+                lines.append("{:<24} {:>8}".format(name, value))
+        if not lines:
+            lines.append("Nothing recorded.")
+        return "\n".join(lines)
+
+
+# shared by all modules
+stats = Stats()
@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+""" Streaming mode: Read search queries line by line (e.g. from stdin),
+resolve them chunk by chunk and write the results as soon as they are
+available. Only one chunk of queries is held in memory at any time, so
+arbitrarily large files can be piped through a single process.
+"""
+
+import os
+import sys
+from itertools import islice
+from typing import Iterable, Iterator, List
+from rtklookup.collection import KanjiCollection
+from rtklookup.searchresults import SearchResult, resolve_results
+from rtklookup.serializer import Writer
+
+
+# number of lines that are resolved together
+CHUNK_SIZE = 1000
+
+
+def read_queries(lines: Iterable[str]) -> Iterator[str]:
+    """ Normalizes the lines like LookupCli.default and skips empty lines.
+    :param lines: E.g. a file object
+    :return: Generator of search queries
+    """
+    for line in lines:
+        line = line.strip().lower()
+        if line:
+            yield line
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[List]:
+    """ Splits $iterable into lists of (at most) $size items. """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def resolve(kanji_collection: KanjiCollection, queries: Iterable[str],
+            chunk_size=CHUNK_SIZE) -> Iterator[List[SearchResult]]:
+    """ Resolves the queries lazily.
+    :param kanji_collection:
+    :param queries: Search queries (one line of user input each)
+    :param chunk_size: Number of queries that are resolved together.
+    :return: Generator of lists of (at most $chunk_size) SearchResults
+    """
+    for chunk in chunked(queries, chunk_size):
+        results = [SearchResult.from_line(query) for query in chunk]
+        resolve_results(kanji_collection, results)
+        yield results
+
+
+def exit_on_broken_pipe():
+    """ To be called if writing to stdout failed because nobody reads from
+    it anymore (e.g. 'rtk -i big.txt | head'): Exits quietly like other
+    line oriented filters. stdout is redirected to devnull first, else
+    flushing it at exit fails again.
+    """
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    sys.exit(1)
+
+
+def run(kanji_collection: KanjiCollection, lines: Iterable[str],
+        writer: Writer, chunk_size=CHUNK_SIZE):
+    """ Reads search queries from $lines and writes the results.
+    :param kanji_collection:
+    :param lines: E.g. a file object
+    :param writer: Writer for the desired output format
+    :param chunk_size: Number of lines that are resolved together.
+    :return: None
+    """
+    try:
+        for results in resolve(kanji_collection, read_queries(lines),
+                               chunk_size=chunk_size):
+            writer.write_many(results)
+            writer.flush()
+    except BrokenPipeError:
+        if writer.out is not sys.stdout:
+            raise
+        exit_on_broken_pipe()
@@ -7,20 +7,38 @@
 import cmd
 import os
 import sys
+from typing import List
 from rtklookup.util import lookup, copy_to_clipboard
 from rtklookup.log import logger
-from rtklookup.collection import KanjiCollection
-from rtklookup.searchresults import SearchResultGroup, SearchResult
+from rtklookup.collection import KanjiCollection, edition_names
+from rtklookup.searchresults import SearchResultGroup, SearchResult, \
+    resolve_results
 from rtklookup.resultprinter import ResultPrinter
+from rtklookup.colorama import get_colorama
+from rtklookup.stats import stats
 from rtklookup import handler
 
 class LookupCli(cmd.Cmd):
     """The command line interface (Cli). """
-    def __init__(self, kanji_collection: KanjiCollection):
-        cmd.Cmd.__init__(self)
+    def __init__(self, kanji_collection: KanjiCollection, stdout=None,
+                 color=True, edition=None):
+        """
+        :param kanji_collection: KanjiCollection of the default edition
+        :param stdout: Output stream (default: sys.stdout)
+        :param color: Print results in color?
+        :param edition: Name of the edition to start with (default: the
+            default edition)
+        """
+        if color and stdout is None:
+            # colorama replaces sys.stdout (on Windows), which cmd.Cmd
+            # stores
+            get_colorama()
+        cmd.Cmd.__init__(self, stdout=stdout)
 
-        # KanjiCollection
-        self.kanji_collection = kanji_collection
+        # KanjiCollection of the default edition and of the current one
+        self.collection = kanji_collection
+        self.kanji_collection = kanji_collection.edition(edition)
+        self.color = color
 
         # todo: move to config?
         self.default_mode = 'default'
@@ -80,12 +98,32 @@ class LookupCli(cmd.Cmd):
             self.search_history.append(line)
             self.search_general(line)
 
-    @staticmethod
-    def print_results(search_item_collection: SearchResult):
+    def print_results(self, search_item_collection: SearchResult):
         # print(search_item_collection)
-        rp = ResultPrinter(search_item_collection)
+        rp = ResultPrinter(search_item_collection, out=self.stdout,
+                           color=self.color)
         rp.print()
 
+    # ----------- Completion ---------------
+
+    def _keyword_completions(self, text: str) -> List[str]:
+        """ Keywords (and single words of keywords) starting with $text,
+        with spaces replaced by '_'. """
+        if text.startswith(self.cmd_separator):
+            return []
+        return [key.replace(' ', '_') for key in
+                self.kanji_collection.prefix_search(text.lower())]
+
+    # cmd.Cmd uses completenames for the first word of the line and
+    # completedefault for all others. Everything is a search phrase for us.
+    # noinspection PyUnusedLocal
+    def completenames(self, text: str, *ignored) -> List[str]:
+        return self._keyword_completions(text)
+
+    # noinspection PyUnusedLocal
+    def completedefault(self, text: str, *ignored) -> List[str]:
+        return self._keyword_completions(text)
+
     # ----------- Handlers ---------------
 
     def emptyline(self):
@@ -126,11 +164,16 @@ class LookupCli(cmd.Cmd):
         """
         if command == 'h':
             print("Basic commands: .q (quit), .h (help), .!<command> "
-                  "(run command in shell), .m (print current mode) ")
-            print("Available modes:")
+                  "(run command in shell), .m (print current mode), "
+                  ".stats [on|off|reset|json] (timings and counters), "
+                  ".e [<edition>] (show/change edition), "
+                  ".color [on|off] (colored results)",
+                  file=self.stdout)
+            print("Available modes:", file=self.stdout)
             for mode in self.modes:
                 print("    %s (.%s): %s" % (mode, self.modes[mode][0],
-                                            self.modes[mode][1]))
+                                            self.modes[mode][1]),
+                      file=self.stdout)
             return
         elif command == 'q':
             handler.exit()
@@ -141,7 +184,16 @@ class LookupCli(cmd.Cmd):
             os.system(command[1:])
             return
         elif command == 'm':
-            print("Current mode is %s." % self.mode)
+            print("Current mode is %s." % self.mode, file=self.stdout)
+            return
+        elif command == 'stats':
+            self.command_stats(rest.strip())
+            return
+        elif command == 'e':
+            self.command_edition(rest.strip())
+            return
+        elif command == 'color':
+            self.command_color(rest.strip())
             return
 
         # changing modes
@@ -173,6 +225,65 @@ class LookupCli(cmd.Cmd):
         # if we come here, the command is not known.
         logger.warning("Command not known. Type '.h' for help.")
 
+    def command_edition(self, name: str):
+        """ Handles the '.e' command.
+        :param name: Edition to change to. If empty, print the current and
+            the available editions.
+        :return: None
+        """
+        if not name:
+            print("Current edition is %s. Available: %s." % (
+                self.kanji_collection.edition_name,
+                ", ".join(edition_names())), file=self.stdout)
+            return
+        try:
+            self.kanji_collection = self.collection.edition(name)
+        except ValueError as e:
+            logger.warning(str(e))
+            return
+        logger.info("Switched to edition %s." % name)
+
+    def command_color(self, action: str):
+        """ Handles the '.color' command.
+        :param action: 'on', 'off' or '' (print the current setting)
+        :return: None
+        """
+        if action in ('on', 'off'):
+            self.color = action == 'on'
+        elif not action:
+            print("Colors are %s." % ('on' if self.color else 'off'),
+                  file=self.stdout)
+        else:
+            logger.warning("Unknown argument '{}' for .color.".format(action))
+
+    def command_stats(self, action: str):
+        """ Handles the '.stats' command.
+        :param action: '' (print summary), 'on', 'off', 'reset' or 'json'
+        :return: None
+        """
+        if action == 'on':
+            stats.enable()
+            logger.info("Recording timings and counters.")
+        elif action == 'off':
+            stats.enable(False)
+            logger.info("Stopped recording timings and counters.")
+        elif action == 'reset':
+            stats.reset()
+        elif action == 'json':
+            print(stats.to_json(cache=self.kanji_collection.cache.stats),
+                  file=self.stdout)
+        elif not action:
+            if not stats.enabled:
+                logger.warning("Recording is off. Use '.stats on' or "
+                               "'rtk --profile'.")
+            print(stats.summary(), file=self.stdout)
+            cache_stats = self.kanji_collection.cache.stats
+            print("\ncache: {hits} hits, {misses} misses, {evictions} "
+                  "evictions, {size}/{maxsize} entries".format(**cache_stats),
+                  file=self.stdout)
+        else:
+            logger.warning("Unknown argument '{}' for .stats.".format(action))
+
     def search_primitive(self, line: str):
         """Looks for kanjis based on primitives.
         :param line
@@ -197,15 +308,10 @@ class LookupCli(cmd.Cmd):
         # and returned exactly 1 result? > for conditional mode
 
         # split up in search words (i.e. single search entries)
-        search_words = line.split(' ')
-        result = SearchResult(line, mode=self.mode)
-        result.groups = \
-            [SearchResultGroup(search_word) for search_word in search_words]
+        result = SearchResult.from_line(line, mode=self.mode)
 
         # perform the searches
-        for search_item in result:
-            search_item.kanji = \
-                self.kanji_collection.search(search_item.search)
+        resolve_results(self.kanji_collection, [result])
 
         if self.mode == 'story':
             # todo: Implement Story mode
@@ -6,8 +6,7 @@
 
 
 import os
-import re
-from rtklookup.colorama import remove_color
+from rtklookup.width import display_width
 
 
 def copy_to_clipboard(clip: str) -> int:
@@ -53,12 +52,9 @@ class CyclicalList(list):
 def approximate_string_length(string: str) -> int:
     """ Note that kanji have about twice the width of latin
     characters. This Function returns the length of $string as a
-    multiple of the length of a latin character.
-    Note: Only works for combinations of Latin characters and (full width)
-          Asian characters.
+    multiple of the length of a latin character (escape sequences are
+    ignored, see width.display_width).
     :param string: String.
     :return:
     """
-    string = remove_color(string)
-    latin_chars_regex = re.compile("[\u0020-\u007f]")
-    return 2*len(string) - len(latin_chars_regex.findall(string))
+    return display_width(string)
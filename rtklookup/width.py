@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+# -*- coding: utf8 -*-
+
+""" Display width of strings in the terminal: Escape sequences (colors) take
+no space, East Asian wide and full width characters (kanji, kana, ...) take
+two columns, combining characters none.
+"""
+
+import re
+import unicodedata
+from typing import List
+
+
+# ANSI escape sequences as written by colorama (e.g. '\x1b[31m')
+_ANSI_REGEX = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+
+
+class _CharWidths(dict):
+    """ Width of every character seen so far, computed on first access. """
+    def __missing__(self, char: str) -> int:
+        if unicodedata.combining(char):
+            width = 0
+        elif unicodedata.east_asian_width(char) in ("W", "F"):
+            width = 2
+        else:
+            width = 1
+        self[char] = width
+        return width
+
+
+_char_widths = _CharWidths()
+
+
+def strip_ansi(string: str) -> str:
+    """ Removes all ANSI escape sequences from $string. """
+    if "\x1b" not in string:
+        return string
+    return _ANSI_REGEX.sub("", string)
+
+
+def char_width(char: str) -> int:
+    """ Number of terminal columns that the character $char takes. """
+    return _char_widths[char]
+
+
+def display_width(string: str) -> int:
+    """ Number of terminal columns that $string takes (escape sequences are
+    ignored). """
+    return sum(map(_char_widths.__getitem__, strip_ansi(string)))
+
+
+class WidthTracker(object):
+    """ Builds up a string piece by piece and keeps track of its display
+    width along the way, so that it never has to be measured as a whole.
+    """
+    def __init__(self):
+        self._parts = []  # type: List[str]
+        self.width = 0
+
+    def append(self, string: str, width=None):
+        """ Adds $string to the end.
+        :param string: May contain escape sequences
+        :param width: Display width of $string if it is already known.
+        :return: None
+        """
+        self._parts.append(string)
+        self.width += display_width(string) if width is None else width
+
+    def append_colored(self, text: str, color="", reset=""):
+        """ Adds $text surrounded by escape sequences. Only $text is
+        measured.
+        :param text: Text without escape sequences
+        :param color: Escape sequence in front of $text
+        :param reset: Escape sequence after $text
+        :return: None
+        """
+        self._parts.append(color + text + reset)
+        self.width += sum(map(_char_widths.__getitem__, text))
+
+    @property
+    def value(self) -> str:
+        """ The string that was built. """
+        return "".join(self._parts)
+
+    def __str__(self):
+        return self.value
@@ -0,0 +1,1055 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+""" Benchmarks. Run from anywhere with
+
+    python3 scripts/benchmark.py [name ...]
+
+If no name is given, all benchmarks are run, with --suite only the
+reproducible core (SUITE): loading, every search mode, primitive search,
+kana conversion and printing.
+
+    python3 scripts/benchmark.py --suite --save scripts/benchmark_baseline.json
+    python3 scripts/benchmark.py --suite --compare scripts/benchmark_baseline.json
+
+--compare exits with status 1 if a duration is more than --threshold
+(default: 25%) slower than in the baseline. Baselines are only
+meaningful on the machine they were recorded on; on shared machines,
+increase the threshold or re-record the baseline first.
+"""
+
+import os
+import os.path
+import sys
+import io
+import time
+import gc
+import contextlib
+import tracemalloc
+import multiprocessing
+import threading
+from unittest.mock import patch
+import random
+import shutil
+import subprocess
+import logging
+import argparse
+import tempfile
+import json
+import platform
+from collections import OrderedDict
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir)
+sys.path.insert(0, REPO_DIR)
+
+from rtklookup.log import logger
+from rtklookup.config import config, load_config
+from rtklookup.collection import Kanji, KanjiCollection, INDEX_THRESHOLDS
+from rtklookup.searchresults import SearchResult, resolve_results, \
+    to_hiragana
+from rtklookup.resultprinter import ResultPrinter
+from rtklookup import serializer
+from rtklookup import daemon
+from rtklookup import width
+from rtklookup.stats import stats
+from rtklookup import stream
+from rtklookup import parallel
+from rtklookup import mmapindex
+
+
+# name -> function returning an OrderedDict of measurements
+BENCHMARKS = OrderedDict()
+
+# Benchmarks with deterministic input that don't depend on other processes
+# (used for baselines)
+SUITE = ["load_rtk", "single_search", "search_modes", "primitive_search",
+         "anagram_search", "search_many", "kana", "printer_long_queries",
+         "width", "fuzzy", "completion"]
+
+DEFAULT_THRESHOLD = 0.25
+# shorter durations are too noisy to be compared
+MIN_COMPARED_DURATION = 0.001
+
+
+def benchmark(function):
+    """ Decorator to register a benchmark. """
+    BENCHMARKS[function.__name__[len("bench_"):]] = function
+    return function
+
+
+def best_of(function, repeat=5, number=1) -> float:
+    """ Minimal time (in seconds) of one call to $function. Like timeit, the
+    garbage collector is disabled while measuring. """
+    best = float("inf")
+    gc_enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                function()
+            best = min(best, (time.perf_counter() - start) / number)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best
+
+
+def ratio(slow: float, fast: float) -> str:
+    """ Formatted speedup. """
+    return "{:.1f}x".format(slow / fast)
+
+
+class BenchmarkFailure(Exception):
+    """ Raised by a benchmark if a measurement exceeds its budget. """
+    pass
+
+
+# ------------- Benchmarks -------------------------------
+
+@benchmark
+def bench_load_rtk():
+    """ Loading the kanji database from the tsv file vs. from the
+    snapshot. """
+    results = OrderedDict()
+    old_enabled = config["snapshot"]["enabled"]
+    old_dir = config["snapshot"]["dir"]
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        config["snapshot"]["dir"] = tmp_dir
+
+        config["snapshot"]["enabled"] = "no"
+        results["tsv"] = best_of(lambda: KanjiCollection()._load_file_rtk())
+
+        config["snapshot"]["enabled"] = "yes"
+        # the first load writes the snapshot
+        KanjiCollection()._load_file_rtk()
+        results["snapshot"] = \
+            best_of(lambda: KanjiCollection()._load_file_rtk())
+    finally:
+        config["snapshot"]["enabled"] = old_enabled
+        config["snapshot"]["dir"] = old_dir
+        shutil.rmtree(tmp_dir)
+    results["speedup"] = ratio(results["tsv"], results["snapshot"])
+    return results
+
+
+@benchmark
+def bench_load_stories():
+    """ Loading synthetic story files of increasing size. The time per row
+    should stay constant. """
+    results = OrderedDict()
+    collection = KanjiCollection()
+    collection._load_file_rtk()
+    delim = bytes(config["rtk_stories"]["delim"], "utf-8").decode(
+        "unicode_escape")
+    kanji_column = config.getint("rtk_stories", "kanji_column")
+    story_column = config.getint("rtk_stories", "story_column")
+    n_columns = max(kanji_column, story_column) + 1
+    for n_rows in [12500, 25000, 50000]:
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8",
+                                         suffix=".tsv") as story_file:
+            for i in range(n_rows):
+                row = [""] * n_columns
+                # cycle through the kanji from the back, i.e. worst case for
+                # a linear scan
+                kanji_obj = collection.kanjis[-1 - i % len(collection.kanjis)]
+                row[kanji_column] = kanji_obj.kanji
+                row[story_column] = "story {} about {}".format(
+                    i, kanji_obj.keyword)
+                story_file.write(delim.join(row) + "\n")
+            story_file.flush()
+            duration = best_of(
+                lambda: collection._load_file_stories(story_file.name),
+                repeat=3
+            )
+        results["{} rows".format(n_rows)] = duration
+        results["{} rows, per row (us)".format(n_rows)] = \
+            "{:.2f}".format(1e6 * duration / n_rows)
+    return results
+
+
+def write_synthetic_stories(collection: KanjiCollection, story_file,
+                            n_words=12, seed=0):
+    """ Writes a story for every kanji of $collection into $story_file.
+    Stories are made up of randomly chosen keywords. """
+    rnd = random.Random(seed)
+    delim = bytes(config["rtk_stories"]["delim"], "utf-8").decode(
+        "unicode_escape")
+    kanji_column = config.getint("rtk_stories", "kanji_column")
+    story_column = config.getint("rtk_stories", "story_column")
+    keywords = [kanji_obj.keyword for kanji_obj in collection.kanjis]
+    for kanji_obj in collection.kanjis:
+        row = [""] * (max(kanji_column, story_column) + 1)
+        row[kanji_column] = kanji_obj.kanji
+        row[story_column] = " ".join(rnd.choice(keywords)
+                                     for _ in range(n_words))
+        story_file.write(delim.join(row) + "\n")
+    story_file.flush()
+
+
+class DictKanji(object):
+    """ Kanji with a __dict__ instead of __slots__ (for bench_memory). """
+    def __init__(self, kanji):
+        self.kanji = kanji
+        self.index = ""
+        self.keyword = ""
+        self.story = ""
+
+
+def record_size(kanji_class_name: str) -> int:
+    """ Memory per kanji record if the collection uses the class
+    $kanji_class_name ('Kanji' or 'DictKanji'). Called in a fresh process:
+    A first, untraced load does everything that is only done once (imports,
+    reading the config, ...), then the second load is traced.
+    """
+    kanji_class = {"Kanji": Kanji, "DictKanji": DictKanji}[kanji_class_name]
+    load_config()
+    with patch("rtklookup.collection.Kanji", kanji_class):
+        KanjiCollection()._load_file_rtk()
+        gc.collect()
+        tracemalloc.start()
+        collection = KanjiCollection()
+        collection._load_file_rtk()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    return size // len(collection.kanjis)
+
+
+@benchmark
+def bench_memory():
+    """ Memory per kanji record (Kanji objects, their strings and the
+    lookup dictionaries) compared to plain objects with a __dict__. Every
+    measurement runs in a fresh process, so that it doesn't depend on the
+    benchmarks that ran before. """
+    results = OrderedDict()
+    context = multiprocessing.get_context("spawn")
+    for key, kanji_class_name in [("__dict__ (bytes/record)", "DictKanji"),
+                                  ("__slots__ (bytes/record)", "Kanji")]:
+        with context.Pool(1) as pool:
+            results[key] = pool.apply(record_size, (kanji_class_name,))
+    return results
+
+
+@benchmark
+def bench_editions():
+    """ Memory and loading time of a further edition (see
+    KanjiCollection.edition) compared to the first one, with stories of 50
+    words per kanji. """
+    results = OrderedDict()
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8",
+                                     suffix=".tsv") as story_file:
+        tracemalloc.start()
+        collection = KanjiCollection()
+        collection._load_file_rtk()
+        collection.load_file_stories(story_file.name)
+        write_synthetic_stories(collection, story_file, n_words=50)
+        collection.materialize_stories()
+        first = tracemalloc.get_traced_memory()[0]
+        edition = collection.edition("6th")
+        edition.materialize_stories()
+        extra = tracemalloc.get_traced_memory()[0] - first
+        tracemalloc.stop()
+    results["first edition (KiB)"] = first // 1024
+    results["extra edition (KiB)"] = extra // 1024
+    results["extra/first"] = "{:.0%}".format(extra / first)
+
+    def load_edition():
+        collection._editions.clear()
+        collection.edition("6th").materialize_stories()
+
+    results["load extra edition"] = best_of(load_edition)
+    return results
+
+
+@benchmark
+def bench_mmap_index():
+    """ Opening the memory mapped index file (see mmapindex.py) compared to
+    loading the collection from the snapshot: time, memory of the process
+    and index, keyword and kanji lookups. """
+    results = OrderedDict()
+    old_dir = config["snapshot"]["dir"]
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        config["snapshot"]["dir"] = tmp_dir
+        # the first calls write the snapshot and the index file
+        collection = KanjiCollection()
+        collection._load_file_rtk()
+        mmapindex.open_index().close()
+        results["index file (KiB)"] = \
+            os.path.getsize(mmapindex.index_path("rtk_data")) // 1024
+
+        results["load snapshot"] = \
+            best_of(lambda: KanjiCollection()._load_file_rtk())
+        results["open index"] = best_of(lambda: mmapindex.open_index().close())
+        results["speedup"] = ratio(results["load snapshot"],
+                                   results["open index"])
+
+        tracemalloc.start()
+        loaded = KanjiCollection()
+        loaded._load_file_rtk()
+        results["heap snapshot (KiB)"] = \
+            tracemalloc.get_traced_memory()[0] // 1024
+        tracemalloc.stop()
+        del loaded
+        tracemalloc.start()
+        index = mmapindex.open_index()
+        results["heap index (KiB)"] = \
+            tracemalloc.get_traced_memory()[0] // 1024
+        tracemalloc.stop()
+
+        rng = random.Random(0)
+        sample = rng.sample(collection.kanjis, 300)
+        words = [kanji_obj.index for kanji_obj in sample] + \
+            [kanji_obj.keyword for kanji_obj in sample] + \
+            [kanji_obj.kanji for kanji_obj in sample]
+
+        def search(searcher):
+            for word in words:
+                searcher.search(word)
+
+        results["900 lookups collection"] = best_of(lambda: search(collection))
+        results["900 lookups index"] = best_of(lambda: search(index))
+        index.close()
+    finally:
+        config["snapshot"]["dir"] = old_dir
+        shutil.rmtree(tmp_dir)
+    return results
+
+
+@benchmark
+def bench_startup():
+    """ Loading everything and performing a single index or keyword search
+    with eagerly and lazily loaded stories (synthetic story for every
+    kanji). Also the time for a complete 'rtk' call. """
+    results = OrderedDict()
+    collection = KanjiCollection()
+    collection._load_file_rtk()
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8",
+                                     suffix=".tsv") as story_file:
+        write_synthetic_stories(collection, story_file, n_words=50)
+        for query in ["1832", "resist"]:
+            def eager():
+                collection = KanjiCollection()
+                collection._load_file_rtk()
+                collection._load_file_stories(story_file.name)
+                collection.search(query)
+
+            def lazy():
+                collection = KanjiCollection()
+                collection._load_file_rtk()
+                collection.load_file_stories(story_file.name)
+                collection.search(query)
+
+            results["{}, eager stories".format(query)] = best_of(eager)
+            results["{}, lazy stories".format(query)] = best_of(lazy)
+
+    for query in ["1832", "resist"]:
+        results["rtk {}".format(query)] = best_of(
+            lambda: subprocess.check_call(
+                [sys.executable, "-m", "rtklookup", query],
+                stdout=subprocess.DEVNULL, cwd=REPO_DIR
+            )
+        )
+    return results
+
+
+@benchmark
+def bench_daemon():
+    """ Latency of 'rtk 1832' with and without a running daemon, the round
+    trip time of a single query to the daemon and 20 clients sending 50
+    queries each in parallel. """
+    results = OrderedDict()
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, "rtklookup.sock")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "rtklookup", "--serve", "--socket", path],
+        cwd=REPO_DIR, stderr=subprocess.DEVNULL
+    )
+    try:
+        while daemon.query(["."], path) is None:
+            time.sleep(0.05)
+        results["rtk 1832, no daemon"] = best_of(
+            lambda: subprocess.check_call(
+                [sys.executable, "-m", "rtklookup", "--no-daemon", "1832"],
+                stdout=subprocess.DEVNULL, cwd=REPO_DIR
+            )
+        )
+        results["rtk 1832, daemon"] = best_of(
+            lambda: subprocess.check_call(
+                [sys.executable, "-m", "rtklookup", "--socket", path, "1832"],
+                stdout=subprocess.DEVNULL, cwd=REPO_DIR
+            )
+        )
+        results["round trip"] = best_of(
+            lambda: daemon.query(["large resist"], path), repeat=20)
+
+        def client():
+            for i in range(50):
+                daemon.query([str(i + 1)], path)
+
+        def parallel_clients():
+            threads = [threading.Thread(target=client) for _ in range(20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        duration = best_of(parallel_clients, repeat=3)
+        results["20 x 50 queries"] = duration
+        results["20 x 50 queries (queries/s)"] = int(1000 / duration)
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(tmp_dir)
+    return results
+
+
+# modules that must not be imported when starting up
+LAZY_MODULES = ["pkg_resources", "romkan", "colorama", "colorlog"]
+# cumulative import time of rtklookup.lookup
+IMPORT_BUDGET = 0.1
+
+
+@benchmark
+def bench_import_time():
+    """ Import time of rtklookup.lookup as reported by -X importtime (best
+    of 5). Fails if it exceeds IMPORT_BUDGET or if one of LAZY_MODULES is
+    imported. """
+    results = OrderedDict()
+    best = float("inf")
+    imported = set()
+    for _ in range(5):
+        output = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c",
+             "import rtklookup.lookup"],
+            stderr=subprocess.PIPE, universal_newlines=True, cwd=REPO_DIR,
+            check=True
+        ).stderr
+        for line in output.splitlines():
+            if "|" not in line or "imported package" in line:
+                continue
+            _, cumulative, module = line.split("|")
+            module = module.strip()
+            imported.add(module.split(".")[0])
+            if module == "rtklookup.lookup":
+                best = min(best, int(cumulative) / 1e6)
+    results["rtklookup.lookup"] = best
+    results["budget"] = IMPORT_BUDGET
+    eager = sorted(imported.intersection(LAZY_MODULES))
+    results["eagerly imported"] = ", ".join(eager) or "-"
+    if eager:
+        raise BenchmarkFailure("Imported at startup: {}".format(
+            ", ".join(eager)))
+    if best > IMPORT_BUDGET:
+        raise BenchmarkFailure("Import time {:.1f} ms exceeds budget".format(
+            1000 * best))
+    return results
+
+
+@benchmark
+def bench_primitive_search():
+    """ Primitive search over synthetic stories of increasing length
+    compared to a plain scan over all stories. """
+    results = OrderedDict()
+    collection = KanjiCollection()
+    collection._load_file_rtk()
+    queries = [["water", "mouth"], ["tree"], ["sun", "moon", "eye"],
+               ["sign_of"], ["thread", "silk", "hair"]]
+
+    def scan():
+        for query in queries:
+            query = [p.replace("_", " ") for p in query]
+            [kanji_obj for kanji_obj in collection.kanjis if kanji_obj.story
+             and all(p in kanji_obj.story for p in query)]
+
+    def indexed():
+        for query in queries:
+            collection.primitive_search(query)
+
+    for n_words in [10, 50, 200]:
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8",
+                                         suffix=".tsv") as story_file:
+            write_synthetic_stories(collection, story_file, n_words=n_words)
+            collection._load_file_stories(story_file.name)
+        results["{} words, scan".format(n_words)] = best_of(scan)
+        results["{} words, index".format(n_words)] = best_of(indexed)
+    return results
+
+
+@benchmark
+def bench_anagram_search():
+    """ 'letters%' queries compared to counting the letters of every
+    keyword. Fails if the results differ for the timed queries or for 500
+    shuffled keywords and random letters. """
+    results = OrderedDict()
+    collection = KanjiCollection()
+    collection._load_file_rtk()
+    collection.cache.maxsize = 0
+    queries = ["hisf", "eagrl", "tsirse", "ou", "noitcerid"]
+
+    def brute_force(query: str):
+        return [kanji_obj for kanji_obj in collection.kanjis
+                if all(kanji_obj.keyword.count(letter) == query.count(letter)
+                       for letter in query)]
+
+    def count():
+        for query in queries:
+            brute_force(query)
+
+    def indexed():
+        for query in queries:
+            collection.search(query + "%")
+
+    rnd = random.Random(0)
+    checked = list(queries)
+    for kanji_obj in rnd.sample(collection.kanjis, 500):
+        keyword = kanji_obj.keyword
+        checked.append("".join(
+            rnd.sample(keyword, rnd.randint(1, len(keyword)))))
+        checked.append("".join(rnd.choice("aeilnorst") for _ in range(3)))
+    for query in checked:
+        # '_' stands for a space in search phrases
+        if collection.search(query.replace(" ", "_") + "%") != \
+                brute_force(query):
+            raise BenchmarkFailure("Results for '{}%' differ from counting "
+                                   "the letters".format(query))
+
+    results["index build"] = best_of(
+        lambda: setattr(collection, "_letter_counts", None) or
+        collection.letter_counts, repeat=3)
+    results["count"] = best_of(count)
+    results["index"] = best_of(indexed)
+    results["speedup"] = ratio(results["count"], results["index"])
+    return results
+
+
+def typo(word: str, rnd: random.Random, n_typos=1) -> str:
+    """ $word with $n_typos random deletions, insertions or replacements of
+    a letter. """
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    word = list(word)
+    for _ in range(n_typos):
+        pos = rnd.randrange(len(word))
+        action = rnd.choice(["delete", "insert", "replace"])
+        if action == "delete" and len(word) > 1:
+            del word[pos]
+        elif action == "insert":
+            word.insert(pos, rnd.choice(letters))
+        else:
+            word[pos] = rnd.choice(letters)
+    return "".join(word)
+
+
+def synthetic_queries(collection: KanjiCollection, n: int, seed=0):
+    """ $n search phrases mixing all search modes (with duplicates). """
+    rnd = random.Random(seed)
+    queries = []
+    for _ in range(n):
+        kanji_obj = rnd.choice(collection.kanjis)
+        keyword = kanji_obj.keyword.replace(" ", "_")
+        queries.append(rnd.choice([
+            kanji_obj.index,
+            keyword,
+            keyword[:rnd.randint(1, 5)] + "?",
+            keyword.split("_")[0] + "+",
+            "".join(rnd.sample(keyword, len(keyword))) + "%",
+            kanji_obj.kanji,
+        ]))
+    return queries
+
+
+@benchmark
+def bench_single_search():
+    """ A single 'word?', 'letters%' and 'word~' search as in one 'rtk'
+    call: Scanning the keywords (the default for the first searches, see
+    INDEX_THRESHOLDS) vs. building the lazy index first. """
+    results = OrderedDict()
+    collection = KanjiCollection()
+    collection._load_file_rtk()
+    collection.cache.maxsize = 0
+    for query, name in [("finis?", "keyword_ngrams"),
+                        ("eagrl%", "letter_counts"),
+                        ("larg~", "keyword_fuzzy")]:
+        def search():
+            setattr(collection, "_" + name, None)
+            collection._index_uses.clear()
+            collection.search(query)
+
+        results["{}, scan".format(query)] = best_of(search)
+        with patch.dict(INDEX_THRESHOLDS, {name: 0}):
+            results["{}, index".format(query)] = best_of(search, repeat=3)
+        results["{}, speedup".format(query)] = ratio(
+            results["{}, index".format(query)],
+            results["{}, scan".format(query)])
+    return results
+
+
+@benchmark
+def bench_search_modes():
+    """ 2000 uncached searches for every search mode
+    (see KanjiCollection.search_mode). """
+    results = OrderedDict()
+    collection = KanjiCollection()
+    collection._load_file_rtk()
+    collection.cache.maxsize = 0
+    rnd = random.Random(0)
+    # kanji that can be found by their index (not e.g. '2001a')
+    indexed = [k for k in collection.kanjis if k.index.isdigit()]
+    kanji_objs = [rnd.choice(indexed) for _ in range(2000)]
+    queries = OrderedDict([
+        ("index", [k.index for k in kanji_objs]),
+        ("keyword", [k.keyword.replace(" ", "_") for k in kanji_objs]),
+        ("substring", [k.keyword[:rnd.randint(1, 5)] + "?"
+                       for k in kanji_objs]),
+        ("token", [k.keyword.split(" ")[0] + "+" for k in kanji_objs]),
+        ("anagram", ["".join(rnd.sample(k.keyword, len(k.keyword))) + "%"
+                     for k in kanji_objs]),
+        # one typo
+        ("fuzzy", [typo(k.keyword, rnd).replace(" ", "_") + "~"
+                   for k in kanji_objs]),
+        ("kanji", ["".join(rnd.choice(collection.kanjis).kanji
+                           for _ in range(3)) for _ in kanji_objs]),
+    ])
+    # build the lazy indices
+    for name in INDEX_THRESHOLDS:
+        getattr(collection, name)
+
+    for mode, words in queries.items():
+        modes = set(collection.search_mode(word.replace("_", " "))
+                    for word in words)
+        if modes != {mode}:
+            raise BenchmarkFailure("Queries for {} are classified as "
+                                   "{}".format(mode, ", ".join(modes)))
+        results[mode] = best_of(
+            lambda: [collection.search(word) for word in words])
+    return results
+
+
+@benchmark
+def bench_fuzzy():
+    """ 'word~' searches for 500 keywords with up to two typos compared to
+    computing the edit distance to every keyword (for 50 of them). """
+    from rtklookup.fuzzy import edit_distance
+    results = OrderedDict()
+    collection = KanjiCollection()
+    collection._load_file_rtk()
+    rnd = random.Random(0)
+    keywords = list(collection.keyword_to_obj)
+    queries = [typo(rnd.choice(keywords), rnd, rnd.randint(1, 2))
+               for _ in range(500)]
+    index = collection.keyword_fuzzy
+
+    def brute_force():
+        # too slow for all queries
+        for query in queries[:50]:
+            max_distance = min(index.max_distance, max(1, len(query) // 4))
+            sorted((distance, keyword) for keyword in keywords
+                   for distance in [edit_distance(query, keyword,
+                                                  max_distance)]
+                   if distance <= max_distance)
+
+    results["index build"] = best_of(
+        lambda: setattr(collection, "_keyword_fuzzy", None) or
+        collection.keyword_fuzzy, repeat=3)
+    results["brute force, per query"] = best_of(brute_force, repeat=1) / 50
+    results["index, per query"] = best_of(
+        lambda: [index.search(query) for query in queries]) / len(queries)
+    results["speedup"] = ratio(results["brute force, per query"],
+                               results["index, per query"])
+    return results
+
+
+@benchmark
+def bench_completion():
+    """ Completing every prefix of 300 keywords (i.e. one completion per
+    keystroke) with KanjiCollection.prefix_search compared to scanning all
+    keys. """
+    results = OrderedDict()
+    collection = KanjiCollection()
+    collection._load_file_rtk()
+    rnd = random.Random(0)
+    keywords = rnd.sample(sorted(collection.keyword_to_obj), 300)
+    prefixes = [keyword[:i] for keyword in keywords
+                for i in range(1, len(keyword) + 1)]
+
+    def scan():
+        keys = collection.prefix_keys
+        for prefix in prefixes:
+            [key for key in keys if key.startswith(prefix)]
+
+    def indexed():
+        for prefix in prefixes:
+            collection.prefix_search(prefix)
+
+    results["index build"] = best_of(
+        lambda: setattr(collection, "_prefix_keys", None) or
+        collection.prefix_keys)
+    results["prefixes"] = len(prefixes)
+    results["scan, per prefix"] = best_of(scan, repeat=3) / len(prefixes)
+    results["index, per prefix"] = best_of(indexed) / len(prefixes)
+    # single letters have the most completions
+    slowest = max("abcdefghijklmnopqrstuvwxyz", key=lambda letter: len(
+        collection.prefix_search(letter)))
+    results["index, '{}'".format(slowest)] = best_of(
+        lambda: collection.prefix_search(slowest), number=100)
+    results["speedup"] = ratio(results["scan, per prefix"],
+                               results["index, per prefix"])
+    return results
+
+
+@benchmark
+def bench_search_many():
+    """ 20000 search phrases one by one vs. with search_many. """
+    results = OrderedDict()
+    collection = KanjiCollection()
+    collection._load_file_rtk()
+    queries = synthetic_queries(collection, 20000)
+    results["search"] = best_of(
+        lambda: [collection.search(query) for query in queries], repeat=3)
+    results["search_many"] = best_of(
+        lambda: collection.search_many(queries), repeat=3)
+    results["speedup"] = ratio(results["search"], results["search_many"])
+    return results
+
+
+@benchmark
+def bench_cache():
+    """ 20000 searches drawn from 500 distinct search phrases with and
+    without the query cache. """
+    results = OrderedDict()
+    collection = KanjiCollection()
+    collection._load_file_rtk()
+    rnd = random.Random(0)
+    distinct = synthetic_queries(collection, 500)
+    queries = [rnd.choice(distinct) for _ in range(20000)]
+
+    maxsize = collection.cache.maxsize
+    collection.cache.maxsize = 0
+    results["uncached"] = best_of(
+        lambda: [collection.search(query) for query in queries], repeat=3)
+    collection.cache.maxsize = maxsize
+    results["cached"] = best_of(
+        lambda: [collection.search(query) for query in queries], repeat=3)
+    results["speedup"] = ratio(results["uncached"], results["cached"])
+    results.update(collection.cache.stats)
+    return results
+
+
+@benchmark
+def bench_parallel():
+    """ 10000 lines of 4 search words with tsv output, streamed in one
+    process vs. with 1..N worker processes. """
+    results = OrderedDict()
+    collection = KanjiCollection()
+    collection._load_file_rtk()
+    # no cache, otherwise the parent process would warm it up
+    collection.cache.maxsize = 0
+    queries = synthetic_queries(collection, 40000)
+    lines = [" ".join(queries[i:i + 4]) for i in range(0, len(queries), 4)]
+
+    results["stream"] = best_of(
+        lambda: stream.run(collection, lines,
+                           serializer.get_writer("tsv", io.StringIO())),
+        repeat=1)
+    n_cpus = multiprocessing.cpu_count()
+    jobs = 1
+    while True:
+        results["{} jobs".format(jobs)] = best_of(
+            lambda: parallel.run(collection, lines, "tsv", jobs,
+                                 out=io.StringIO()),
+            repeat=1)
+        if jobs >= n_cpus:
+            break
+        jobs = min(2 * jobs, n_cpus)
+    results["cpus"] = n_cpus
+    return results
+
+
+@benchmark
+def bench_kana():
+    """ Building, classifying and printing 2000 results of 5 words (a mix of
+    search phrases, romaji and kana) with cold and warm kana conversion
+    cache. """
+    results = OrderedDict()
+    collection = KanjiCollection()
+    collection._load_file_rtk()
+    rnd = random.Random(0)
+    words = synthetic_queries(collection, 3000) + \
+        ["tei", "kana", "shita", "nihongo", "てい", "かな", "xq"] * 300
+    lines = [" ".join(rnd.sample(words, 5)) for _ in range(2000)]
+
+    def build_and_print():
+        search_results = [SearchResult.from_line(line) for line in lines]
+        resolve_results(collection, search_results)
+        out = io.StringIO()
+        for result in search_results:
+            for group in result.groups:
+                group.type, group.is_broken, group.needs_details
+            ResultPrinter(result, out=out).print()
+
+    def cold():
+        to_hiragana.cache_clear()
+        build_and_print()
+
+    results["cold conversion cache"] = best_of(cold, repeat=3)
+    results["warm conversion cache"] = best_of(build_and_print, repeat=3)
+    results["conversion cache hits"] = to_hiragana.cache_info().hits
+    return results
+
+
+@benchmark
+def bench_printer_long_queries():
+    """ Printing the results of 20 queries of 1000 words each. """
+    results = OrderedDict()
+    collection = KanjiCollection()
+    collection._load_file_rtk()
+    rnd = random.Random(0)
+    words = [kanji_obj.keyword.replace(" ", "_")
+             for kanji_obj in collection.kanjis] + ["tei", "xq", "fish+"]
+    search_results = [SearchResult.from_line(" ".join(
+        rnd.choice(words) for _ in range(1000))) for _ in range(20)]
+    resolve_results(collection, search_results)
+
+    def print_all():
+        out = io.StringIO()
+        for result in search_results:
+            ResultPrinter(result, out=out).print()
+
+    results["print"] = best_of(print_all, repeat=3)
+    return results
+
+
+@benchmark
+def bench_width():
+    """ Display width of colored first lines compared to the former
+    implementation that compiled its regular expressions on every call. """
+    import re
+    from rtklookup.colorama import get_colorama
+    results = OrderedDict()
+    colorama = get_colorama()
+    rnd = random.Random(0)
+    chars = "抵抗大魚ていまabcxyz"
+    colors = [colorama.Fore.RED, colorama.Fore.BLUE, colorama.Fore.CYAN]
+    lines = ["".join(rnd.choice(colors) + rnd.choice(chars) +
+                     colorama.Style.RESET_ALL for _ in range(n))
+             for n in [1, 5, 20, 100] for _ in range(250)]
+
+    def legacy_width(string):
+        names = ["BLACK", "RED", "GREEN", "YELLOW", "BLUE", "MAGENTA", "CYAN",
+                 "WHITE", "RESET"]
+        sequences = [getattr(colorama.Fore, name) for name in names] + \
+            [getattr(colorama.Back, name) for name in names] + \
+            [getattr(colorama.Style, name)
+             for name in ["DIM", "NORMAL", "BRIGHT", "RESET_ALL"]]
+        regex = re.compile("[^{}]".format(
+            "".join(re.escape(sequence) for sequence in sequences)))
+        string = "".join(regex.findall(string))
+        return 2 * len(string) - len(re.compile(
+            "[\u0020-\u007f]").findall(string))
+
+    parts = [[(part[-1], part[:-1]) for part in
+              line.split(colorama.Style.RESET_ALL) if part] for line in lines]
+
+    def build_then_measure():
+        for line_parts in parts:
+            line = ""
+            for text, color in line_parts:
+                line += color + text + colorama.Style.RESET_ALL
+            legacy_width(line)
+
+    def build_tracked():
+        for line_parts in parts:
+            tracker = width.WidthTracker()
+            for text, color in line_parts:
+                tracker.append_colored(text, color, colorama.Style.RESET_ALL)
+            tracker.value
+
+    results["legacy"] = best_of(lambda: [legacy_width(l) for l in lines])
+    results["display_width"] = best_of(
+        lambda: [width.display_width(l) for l in lines])
+    results["speedup"] = ratio(results["legacy"], results["display_width"])
+    results["build, legacy"] = best_of(build_then_measure)
+    results["build, tracker"] = best_of(build_tracked)
+    return results
+
+
+@benchmark
+def bench_stats():
+    """ Overhead of the instrumentation (see stats.py) on uncached
+    searches. """
+    results = OrderedDict()
+    collection = KanjiCollection()
+    collection._load_file_rtk()
+    collection.cache.maxsize = 0
+    queries = synthetic_queries(collection, 20000)
+    collection.search_many(queries[:100])
+
+    stats.enable(False)
+    results["disabled"] = best_of(lambda: collection.search_many(queries))
+    stats.enable()
+    try:
+        results["enabled"] = best_of(lambda: collection.search_many(queries))
+    finally:
+        stats.enable(False)
+        stats.reset()
+    return results
+
+
+@benchmark
+def bench_output_formats():
+    """ Writing 5000 results with the (colored) ResultPrinter and the
+    machine readable formats. """
+    results = OrderedDict()
+    collection = KanjiCollection()
+    collection._load_file_rtk()
+    queries = synthetic_queries(collection, 20000)
+    lines = [" ".join(queries[i:i + 4]) for i in range(0, len(queries), 4)]
+    search_results = [SearchResult.from_line(line) for line in lines]
+    resolve_results(collection, search_results)
+
+    for fmt in serializer.FORMATS:
+        def write():
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                serializer.get_writer(fmt, out).write_many(search_results)
+        duration = best_of(write, repeat=3)
+        results[fmt] = duration
+        results[fmt + " (results/s)"] = int(len(search_results) / duration)
+
+    # Unbuffered pipe to /dev/null: every write call is a system call
+    class CountingWriter(io.TextIOWrapper):
+        calls = 0
+
+        def write(self, string):
+            CountingWriter.calls += 1
+            return super().write(string)
+
+    for color in [True, False]:
+        label = "pretty, {}".format("color" if color else "no color")
+
+        def write_unbuffered():
+            with open(os.devnull, "wb", buffering=0) as devnull:
+                out = CountingWriter(devnull, encoding="utf-8",
+                                     write_through=True)
+                serializer.get_writer("pretty", out, color=color).write_many(
+                    search_results)
+                out.detach()
+
+        results[label + ", unbuffered"] = best_of(write_unbuffered, repeat=3)
+    CountingWriter.calls = 0
+    write_unbuffered()
+    results["pretty, write calls"] = CountingWriter.calls
+    return results
+
+
+# ------------- Baselines -------------------------------
+
+def save_baseline(path: str, all_results: dict):
+    """ Writes the results of a run to $path (json). """
+    data = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": all_results,
+    }
+    with open(path, "w", encoding="utf-8") as outfile:
+        json.dump(data, outfile, indent=2, sort_keys=True)
+        outfile.write("\n")
+
+
+def compare_to_baseline(path: str, all_results: dict,
+                        threshold: float) -> list:
+    """ Compares the durations of a run to the baseline in $path.
+    :param path: Baseline written by save_baseline
+    :param all_results: benchmark name -> measurements
+    :param threshold: Relative slowdown that counts as regression
+    :return: List of regressions (benchmark, key, baseline, current)
+    """
+    with open(path, encoding="utf-8") as infile:
+        baseline = json.load(infile)["results"]
+    regressions = []
+    print("Comparison to {} (threshold {:.0%}):".format(path, threshold))
+    for name, results in all_results.items():
+        for key, value in results.items():
+            old = baseline.get(name, {}).get(key)
+            # only durations are compared
+            if not isinstance(value, float) or not isinstance(old, float):
+                continue
+            change = value / old - 1 if old else 0.
+            flag = ""
+            if max(old, value) < MIN_COMPARED_DURATION:
+                flag = "(too short)"
+            elif change > threshold:
+                flag = "REGRESSION"
+                regressions.append((name, key, old, value))
+            print("    {:<42} {:10.3f} -> {:10.3f} ms {:>+7.0%} {}".format(
+                "{}: {}".format(name, key), 1000 * old, 1000 * value,
+                change, flag))
+    return regressions
+
+
+# ------------- Main -------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("names", nargs="*",
+                        help="Benchmarks to run (default: all). Available: "
+                             "{}".format(", ".join(BENCHMARKS)))
+    parser.add_argument("--suite", action="store_true",
+                        help="Run the benchmarks of the core suite: "
+                             "{}".format(", ".join(SUITE)))
+    parser.add_argument("--save", metavar="FILE",
+                        help="Save the results as baseline (json)")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="Compare the results to a baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Relative slowdown that counts as regression "
+                             "(default: %(default)s)")
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error("Unknown benchmark {}".format(name))
+    names = list(args.names)
+    if args.suite:
+        names += [name for name in SUITE if name not in names]
+
+    logger.setLevel(logging.WARNING)
+    load_config()
+
+    failed = []
+    all_results = OrderedDict()
+    for name in names or BENCHMARKS:
+        print("{}:".format(name))
+        try:
+            results = BENCHMARKS[name]()
+        except BenchmarkFailure as e:
+            print("    FAILED: {}".format(e))
+            failed.append(name)
+            continue
+        all_results[name] = results
+        for key, value in results.items():
+            # floats are durations in seconds
+            if isinstance(value, float):
+                print("    {:<30} {:10.3f} ms".format(key, 1000 * value))
+            else:
+                print("    {:<30} {:>10}".format(key, value))
+
+    if args.save:
+        save_baseline(args.save, all_results)
+        print("Saved baseline to {}.".format(args.save))
+    if args.compare:
+        regressions = compare_to_baseline(args.compare, all_results,
+                                          args.threshold)
+        if regressions:
+            failed.append("{} regression(s)".format(len(regressions)))
+
+    if failed:
+        print("Failed: {}".format(", ".join(failed)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf8 -*-
+
+""" Load generator for the asynchronous query server (rtk --serve-async).
+Opens several connections that pipeline queries and reports the latency
+percentiles and the throughput. Run from anywhere with
+
+    python3 scripts/loadgen.py --spawn
+"""
+
+import os
+import os.path
+import sys
+import time
+import random
+import socket
+import asyncio
+import argparse
+import subprocess
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.pardir)
+
+
+QUERIES = ["1832", "large resist", "fish+", "fin?", "large tei", "eagrl%",
+           "sign_of_the_hog", "図書館", "water mouth tree", "wat?"]
+
+
+async def client(host: str, port: int, n_queries: int, window: int,
+                 latencies: list, seed: int):
+    """ Sends $n_queries queries over one connection with at most $window
+    unanswered queries. The queries are drawn at random with $seed. """
+    reader, writer = await asyncio.open_connection(host, port)
+    rnd = random.Random(seed)
+    sent = []
+    in_flight = asyncio.Semaphore(window)
+
+    async def send():
+        for _ in range(n_queries):
+            await in_flight.acquire()
+            sent.append(time.perf_counter())
+            writer.write((rnd.choice(QUERIES) + "\n").encode("utf-8"))
+            await writer.drain()
+
+    sender = asyncio.ensure_future(send())
+    for i in range(n_queries):
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("Server closed the connection")
+        latencies.append(time.perf_counter() - sent[i])
+        in_flight.release()
+    await sender
+    writer.close()
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+def wait_for_server(host: str, port: int, timeout=30):
+    start = time.time()
+    while time.time() - start < timeout:
+        try:
+            socket.create_connection((host, port)).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError("Server didn't start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--connections", "-c", type=int, default=20)
+    parser.add_argument("--queries", "-n", type=int, default=2000,
+                        help="Queries per connection")
+    parser.add_argument("--window", "-w", type=int, default=32,
+                        help="Maximal number of unanswered queries per "
+                             "connection")
+    parser.add_argument("--spawn", action="store_true",
+                        help="Start the server (and stop it afterwards)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the random queries (connection i "
+                             "uses seed + i)")
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn:
+        server = subprocess.Popen(
+            [sys.executable, "-m", "rtklookup", "--serve-async",
+             "--port", str(args.port)],
+            cwd=REPO_DIR
+        )
+    try:
+        wait_for_server(args.host, args.port)
+        latencies = []
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        start = time.perf_counter()
+        loop.run_until_complete(asyncio.gather(*[
+            client(args.host, args.port, args.queries, args.window, latencies,
+                   args.seed + client_id)
+            for client_id in range(args.connections)
+        ]))
+        duration = time.perf_counter() - start
+        loop.close()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print("{} connections x {} queries (window {})".format(
+        args.connections, args.queries, args.window))
+    print("    p50 latency   {:10.3f} ms".format(
+        1000 * percentile(latencies, 50)))
+    print("    p99 latency   {:10.3f} ms".format(
+        1000 * percentile(latencies, 99)))
+    print("    queries/s     {:10.0f}".format(len(latencies) / duration))
+
+
+if __name__ == "__main__":
+    main()